@@ -0,0 +1,346 @@
+"""Beatmap analysis: onset detection for a song, independent of the game window."""
+import librosa
+import numpy as np
+import audio
+import beatmap_cache
+from charts import ONSET_DTYPE, empty_onsets
+from profiler import stage
+from librosa.util.exceptions import ParameterError
+from librosa.onset import onset_backtrack
+
+def get_adaptive_parameters(tempo, onset_env, sr):
+    # normalize the envelope to [0,1]
+    if onset_env.max() > 0:
+        onset_env = onset_env / np.max(onset_env)
+
+    # dynamic range
+    dynamic_range = np.max(onset_env) - np.min(onset_env)
+
+    # a more modest delta
+    #    – 75th percentile of the *normalized* envelope is in [0,1]
+    #    – scale it by a constant in [0.5, 0.8] instead of multiplying back by the big dynamic_range
+    perc75 = np.percentile(onset_env, 75)
+    delta  = perc75 * (0.65 + 0.25 * (1 - dynamic_range))
+
+    # beat-based windows (unchanged), beat_track's tempo is a 1-element array on newer librosa
+    beat_interval   = 60.0 / float(np.atleast_1d(tempo)[0])
+    frames_per_beat = int(beat_interval * sr / 512)
+
+    return {
+        'delta':    delta,
+        'pre_max':  int(frames_per_beat * 1.5),
+        'post_max': int(frames_per_beat * 1.5),
+        'pre_avg':  max(3, int(frames_per_beat * 0.7)),
+        'post_avg': max(3, int(frames_per_beat * 0.7)),
+        'wait':     max(1, int(frames_per_beat * 0.3)),
+    }
+
+def select_parameters(tempo, onset_env, sr, delta=0.22, pre_max=10.5, post_max=10.5, auto:bool = True):
+    if auto:
+        return get_adaptive_parameters(tempo, onset_env, sr)
+    return {
+        'delta': delta,
+        'pre_max': int(pre_max),
+        'post_max': int(post_max),
+        'pre_avg': 5,
+        'post_avg': 5,
+        'wait': 2
+    }
+
+# mel bins where the bands lanes are picked from split, roughly at 400 Hz and 2 kHz
+BAND_EDGES = (0, 20, 60, 128)
+_BAND_WEIGHTS = np.diff(BAND_EDGES) / BAND_EDGES[-1]
+TOP_DB = 80.0
+
+def mel_db(S, loudest=-np.inf):
+    """power_to_db of a mel spectrogram, floored TOP_DB below the loudest frame so far.
+
+    Returns (S_db, loudest) so the next block of the same song can carry on.
+    power_to_db's own top_db floors below the loudest bin of the whole song,
+    which a block by block analysis can't know yet; this one only looks
+    back, so both ways of analysing a song get the same values."""
+    S = librosa.power_to_db(S, ref=1.0, top_db=None)
+    if S.shape[1] == 0:
+        return S, loudest
+    floor = np.maximum.accumulate(np.maximum(S.max(axis=0), loudest))
+    np.maximum(S, floor - TOP_DB, out=S)
+    return S, float(floor[-1])
+
+def band_scales(onset_env, band_env):
+    """What strength 1.0 means for the full envelope and for each band's, loud outliers aside."""
+    tiny = np.finfo(np.float32).tiny
+    return max(float(np.percentile(onset_env, 99)), tiny), np.maximum(np.percentile(band_env, 99, axis=1), tiny)
+
+def onset_records(times, peaks, onset_env, band_env, env_scale, band_scale):
+    """ONSET_DTYPE records of onsets at times, band and strength read at their (not backtracked) peak frames."""
+    onsets = np.empty(len(times), dtype=ONSET_DTYPE)
+    onsets["time"] = times
+    # the band that rose the most compared to how much it usually does
+    onsets["band"] = np.argmax(band_env[:, peaks] / band_scale[:, np.newaxis], axis=0)
+    onsets["strength"] = np.clip(onset_env[peaks] / env_scale, 0.0, 1.0)
+    return onsets
+
+def analyze_song(y, sr, delta=0.22, pre_max=10.5, post_max=10.5, auto:bool = True, timings=None):
+    """Returns (onsets, tempo, song_duration), onsets being ONSET_DTYPE records for charts.build_charts.
+
+    timings (a dict) gets the seconds spent per stage."""
+    # Extract features: one spectrogram, an onset envelope per band, and the full envelope as the
+    # band envelopes' mean weighted by their width (the same as onset_strength over all the bins)
+    with stage(timings, "onset_strength"):
+        S, _ = mel_db(librosa.feature.melspectrogram(y=y, sr=sr, n_mels=BAND_EDGES[-1]))
+        band_env = librosa.onset.onset_strength_multi(S=S, sr=sr, channels=BAND_EDGES)
+        del S
+        onset_env = _BAND_WEIGHTS @ band_env
+    onsets, tempo = detect_onsets(onset_env, band_env, sr, delta, pre_max, post_max, auto, timings)
+    song_duration = librosa.get_duration(y=y, sr=sr)
+
+    return onsets, tempo, song_duration
+
+def detect_onsets(onset_env, band_env, sr, delta=0.22, pre_max=10.5, post_max=10.5, auto:bool = True, timings=None):
+    """Returns (onsets, tempo) from the envelopes of a whole song, see analyze_song."""
+    with stage(timings, "beat_track"):
+        tempo, _ = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr)
+    
+    # Parameter selection
+    params = select_parameters(tempo, onset_env, sr, delta, pre_max, post_max, auto)
+
+    # Detect onsets with selected parameters
+    with stage(timings, "onset_detect"):
+        raw_frames = librosa.onset.onset_detect(
+            sr=sr,
+            delta=params['delta'],
+            pre_max=params['pre_max'],
+            post_max=params['post_max'],
+            pre_avg=params['pre_avg'],
+            post_avg=params['post_avg'],
+            wait=params['wait'],
+            backtrack=False,
+            onset_envelope=onset_env
+        )
+    
+    with stage(timings, "backtrack"):
+        if raw_frames.size > 0:
+            try:
+                onset_frames = onset_backtrack(raw_frames, onset_env)
+            except ParameterError:
+                onset_frames = raw_frames
+        else:
+            onset_frames = raw_frames
+        
+    # Convert results
+    onsets = onset_records(librosa.frames_to_time(onset_frames, sr=sr), raw_frames, onset_env, band_env, *band_scales(onset_env, band_env))
+    return onsets, tempo
+
+def cached_beatmap(audio_path, delta=0.22, pre_max=10.5, post_max=10.5, auto:bool = True):
+    """Return the cached (onsets, tempo, song_duration) of audio_path, or None."""
+    return beatmap_cache.load(_beatmap_key(audio_path, delta, pre_max, post_max, auto))
+
+def _beatmap_key(audio_path, delta, pre_max, post_max, auto):
+    return beatmap_cache.cache_key(beatmap_cache.file_hash(audio_path), delta, pre_max, post_max, auto)
+
+def load_beatmap(audio_path, delta=0.22, pre_max=10.5, post_max=10.5, auto:bool = True, use_cache:bool = True):
+    """Return (onsets, tempo, song_duration), from the beatmap cache when possible.
+
+    With use_cache=False the song is always analysed and the cache entry replaced."""
+    # Reuse the beatmap if this song was already analysed with the same parameters
+    key = _beatmap_key(audio_path, delta, pre_max, post_max, auto)
+    cached = beatmap_cache.load(key) if use_cache else None
+    if cached is not None:
+        return cached
+
+    _, y, sr = audio.decode(audio_path)
+    beatmap = analyze_song(y, sr, delta, pre_max, post_max, auto)
+    beatmap_cache.store(key, *beatmap)
+    return beatmap
+
+def prepare_song(audio_path, mixer_frequency, mixer_channels, delta=0.22, pre_max=10.5, post_max=10.5, auto:bool = True, timings=None):
+    """Decode audio_path once for playback and, on a cache miss, for the analysis.
+
+    Returns (pcm, (onsets, tempo, song_duration)). timings, if given, gets
+    the seconds spent in "cache", "load" and the analyze_song stages."""
+    key = _beatmap_key(audio_path, delta, pre_max, post_max, auto)
+    with stage(timings, "cache"):
+        beatmap = beatmap_cache.load(key)
+
+    with stage(timings, "load"):
+        pcm, y, sr = audio.decode(audio_path, mixer_frequency, mixer_channels, analysis=beatmap is None)
+    if beatmap is None:
+        beatmap = analyze_song(y, sr, delta, pre_max, post_max, auto, timings)
+        beatmap_cache.store(key, *beatmap)
+    return pcm, beatmap
+
+# Streaming analysis, for songs too long to hold in memory at once
+
+# songs at least this long are analysed block by block and played straight from disk
+STREAMING_MIN_DURATION = 15 * 60
+STREAM_BLOCK_FRAMES = 256  # onset frames decoded per block
+STREAM_HEAD_SECONDS = 30  # chart that has to be ready before the song can start
+
+_HOP_LENGTH = 512
+_N_FFT = 2048
+
+def is_long_song(audio_path):
+    """True for songs long enough to stream that can be streamed.
+
+    librosa.stream only reads through soundfile, so whatever it can't open
+    (m4a, aac, wma, mp3 on an older libsndfile) is decoded whole through
+    audioread instead, however long it is."""
+    import soundfile
+    try:
+        info = soundfile.info(audio_path)
+    except Exception:  # LibsndfileError on newer soundfile, RuntimeError on older ones
+        return False
+    return info.duration >= STREAMING_MIN_DURATION
+
+def stream_beatmap(audio_path, delta=0.22, pre_max=10.5, post_max=10.5, auto:bool = True, head_seconds=STREAM_HEAD_SECONDS):
+    """Analyse audio_path block by block, holding only one block of audio at a time.
+
+    The envelopes come out the same as analyze_song's: the blocks are
+    resampled to ANALYSIS_SR as one continuous stream and framed like a
+    centered spectrogram. Yields ("onsets", onsets) as parts of the chart get
+    final and a single ("head", (tempo, song_duration)) once the first
+    head_seconds of the chart have been yielded. That chart is picked with
+    tempo, the adaptive parameters and the scales estimated from the head.
+    When the stream ends the beatmap is picked again from the whole
+    envelopes, like analyze_song does, and that one is cached."""
+    import soxr  # the resampler behind librosa.resample, kept running across blocks so their edges resample like one signal
+    sr = audio.ANALYSIS_SR
+    native_sr = librosa.get_samplerate(audio_path)
+    song_duration = librosa.get_duration(path=audio_path)
+    resampler = soxr.ResampleStream(native_sr, sr, 1, dtype="float32", quality="HQ") if native_sr != sr else None
+
+    # the envelopes are tiny next to the audio (a few floats per hop), so they are kept whole
+    onset_env = np.zeros(int(np.ceil(song_duration * sr / _HOP_LENGTH)) + STREAM_BLOCK_FRAMES + 3)
+    band_env = np.zeros((len(BAND_EDGES) - 1, onset_env.size), dtype=np.float32)
+    frames = 0  # spectrogram frames so far, also how much of the envelopes is final
+    samples = 0
+    head_frames = int(head_seconds * sr / _HOP_LENGTH)
+    pending = np.zeros(_N_FFT // 2, dtype=np.float32)  # a centered spectrogram's zero padding at the start
+    loudest = -np.inf
+    previous_frame = None
+
+    picker = None
+    head = None
+    blocks = librosa.stream(audio_path, block_length=STREAM_BLOCK_FRAMES, frame_length=_HOP_LENGTH, hop_length=_HOP_LENGTH, mono=True)
+    for block, last in _with_last(blocks):
+        y = resampler.resample_chunk(np.ascontiguousarray(block), last=last) if resampler is not None else block
+        samples += y.size
+        pending = np.concatenate((pending, y, np.zeros(_N_FFT // 2, dtype=np.float32) if last else y[:0]))
+        count = 1 + (pending.size - _N_FFT) // _HOP_LENGTH if pending.size >= _N_FFT else 0
+        if count == 0:
+            continue
+        S = librosa.feature.melspectrogram(y=pending[:_N_FFT + (count - 1) * _HOP_LENGTH], sr=sr, n_fft=_N_FFT, hop_length=_HOP_LENGTH, n_mels=BAND_EDGES[-1], center=False)
+        pending = pending[count * _HOP_LENGTH:]
+        S, loudest = mel_db(S, loudest)
+
+        # onset_strength_multi's spectral flux, frame k's rise over frame k - 1 lands at k + 2 (its lag and centering shift)
+        if previous_frame is None:
+            rise = np.maximum(0.0, np.diff(S, axis=1))
+            first = frames + 1
+        else:
+            rise = np.maximum(0.0, np.diff(np.column_stack((previous_frame, S)), axis=1))
+            first = frames
+        previous_frame = S[:, -1]
+        at = first + 2
+        if at + rise.shape[1] > onset_env.size:  # the duration the header claims was short
+            grow = at + rise.shape[1] + STREAM_BLOCK_FRAMES - onset_env.size
+            onset_env = np.concatenate((onset_env, np.zeros(grow)))
+            band_env = np.concatenate((band_env, np.zeros((band_env.shape[0], grow), dtype=np.float32)), axis=1)
+        for band, (low, high) in enumerate(zip(BAND_EDGES, BAND_EDGES[1:])):
+            band_env[band, at:at + rise.shape[1]] = rise[low:high].mean(axis=0)
+        onset_env[at:at + rise.shape[1]] = _BAND_WEIGHTS @ band_env[:, at:at + rise.shape[1]]
+        frames += S.shape[1]
+
+        if picker is None and frames >= head_frames:
+            picker, head = _start_stream_picker(onset_env[:frames], band_env[:, :frames], sr, song_duration, delta, pre_max, post_max, auto)
+        if picker is not None and not last:
+            onsets = picker.pick(onset_env, band_env, frames, final=False)
+            if onsets.size:
+                yield "onsets", onsets
+            if head is not None:
+                yield "head", head
+                head = None
+
+    if picker is None:  # shorter than the head, everything is the head
+        picker, head = _start_stream_picker(onset_env[:frames], band_env[:, :frames], sr, song_duration, delta, pre_max, post_max, auto)
+    onsets = picker.pick(onset_env, band_env, frames, final=True)
+    if onsets.size:
+        yield "onsets", onsets
+    if head is not None:
+        yield "head", head
+
+    onsets, tempo = detect_onsets(onset_env[:frames], band_env[:, :frames], sr, delta, pre_max, post_max, auto)
+    beatmap_cache.store(_beatmap_key(audio_path, delta, pre_max, post_max, auto), onsets, tempo, samples / sr)
+
+def _with_last(iterable):
+    """(item, is_last) pairs."""
+    iterator = iter(iterable)
+    try:
+        item = next(iterator)
+    except StopIteration:
+        return
+    for following in iterator:
+        yield item, False
+        item = following
+    yield item, True
+
+def _start_stream_picker(head_env, head_band_env, sr, song_duration, delta, pre_max, post_max, auto):
+    tempo, _ = librosa.beat.beat_track(onset_envelope=head_env, sr=sr, hop_length=_HOP_LENGTH)
+    params = select_parameters(tempo, head_env, sr, delta, pre_max, post_max, auto)
+    picker = _StreamPeakPicker(params, head_env, head_band_env, sr, tempo)
+    return picker, (picker.tempo, song_duration)
+
+class _StreamPeakPicker:
+    """Incremental onset_detect + onset_backtrack over a growing envelope.
+
+    A frame is only decided once post_max/post_avg frames after it exist, so
+    a peak never changes after it has been handed out."""
+
+    def __init__(self, params, head_env, head_band_env, sr, tempo):
+        self.params = params
+        self.sr = sr
+        self.tempo = float(np.atleast_1d(tempo)[0])
+        # onset_detect normalizes by the whole envelope, the head has to stand in for it here,
+        # and for the scales onset strengths and bands are measured against
+        self.offset = float(head_env.min())
+        self.scale = float(head_env.max() - self.offset) or 1.0
+        self.strength_scales = band_scales(head_env, head_band_env)
+        self.lookahead = max(params['post_max'], params['post_avg']) + 1
+        self.context = max(params['pre_max'], params['pre_avg'])
+        self.committed = 0  # frames before this are decided
+        self.last_peak = -np.inf
+
+    def pick(self, onset_env, band_env, filled, final):
+        ready = filled if final else filled - self.lookahead
+        if ready <= self.committed:
+            return empty_onsets()
+
+        start = max(0, self.committed - self.context)
+        segment = (onset_env[start:filled] - self.offset) / self.scale
+        peaks = librosa.util.peak_pick(
+            segment,
+            pre_max=self.params['pre_max'],
+            post_max=self.params['post_max'],
+            pre_avg=self.params['pre_avg'],
+            post_avg=self.params['post_avg'],
+            delta=self.params['delta'],
+            wait=0,
+        ) + start
+
+        # same greedy `wait` rule as peak_pick, carried across segments
+        frames = []
+        for peak in peaks:
+            if self.committed <= peak < ready and peak > self.last_peak + self.params['wait']:
+                frames.append(peak)
+                self.last_peak = peak
+        self.committed = ready
+        if not frames:
+            return empty_onsets()
+
+        peaks = np.asarray(frames)
+        try:
+            frames = onset_backtrack(peaks - start, onset_env[start:filled]) + start
+        except ParameterError:
+            frames = peaks
+        times = librosa.frames_to_time(frames, sr=self.sr, hop_length=_HOP_LENGTH)
+        return onset_records(times, peaks, onset_env, band_env, *self.strength_scales)
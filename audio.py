@@ -0,0 +1,73 @@
+"""Decodes a song once into mixer-ready playback samples and a small view for the analysis."""
+import struct
+import numpy as np
+
+# onset analysis runs on a mono copy at this rate instead of the file's native rate
+ANALYSIS_SR = 22050
+
+
+def decode(audio_path, mixer_frequency=None, mixer_channels=2, analysis=True):
+    """Decode audio_path once and return (pcm, y, sr).
+
+    pcm is int16 audio in the mixer's rate and channel layout, ready for
+    to_wav_bytes, or None when mixer_frequency is None.
+    y is a mono float32 copy at sr=ANALYSIS_SR for the analysis, or None
+    when analysis is False."""
+    import librosa  # takes seconds to import with numba behind it, only decoding needs it
+
+    samples, native_sr = librosa.load(audio_path, sr=None, mono=False, dtype=np.float32)
+    samples = np.atleast_2d(samples)  # (channels, length) even for mono files
+
+    y = None
+    if analysis:
+        y = librosa.resample(librosa.to_mono(samples), orig_sr=native_sr, target_sr=ANALYSIS_SR)
+
+    pcm = None
+    if mixer_frequency is not None:
+        pcm = to_pcm(samples, native_sr, mixer_frequency, mixer_channels)  # clips samples in place, they're not needed after
+    del samples  # the full rate float copy is the biggest thing we hold, drop it before returning
+
+    return pcm, y, ANALYSIS_SR
+
+
+def to_pcm(samples, sr, mixer_frequency, mixer_channels):
+    """Convert float samples of shape (channels, length) to int16 playback samples.
+
+    samples may be clipped in place, pass a copy if the caller still needs them."""
+    if samples.shape[0] != mixer_channels:
+        samples = samples.mean(axis=0, keepdims=True)
+        if mixer_channels > 1:
+            samples = np.repeat(samples, mixer_channels, axis=0)
+    if sr != mixer_frequency:
+        import librosa
+        samples = librosa.resample(samples, orig_sr=sr, target_sr=mixer_frequency)
+
+    pcm = np.empty((samples.shape[1], mixer_channels), dtype=np.int16)
+    np.clip(samples, -1.0, 1.0, out=samples)  # in place, a clipped copy would be as big as the song again
+    np.multiply(samples.T, 32767, out=pcm, casting="unsafe")
+    # (length,) for a mono mixer and (length, channels) otherwise, like pygame.sndarray
+    return pcm[:, 0].copy() if mixer_channels == 1 else pcm
+
+
+WAV_HEADER_SIZE = 44
+
+
+def wav_header(pcm, frequency):
+    """The 44 byte header of a 16 bit PCM WAV holding pcm."""
+    channels = 1 if pcm.ndim == 1 else pcm.shape[1]
+    data_size = pcm.size * 2
+    return struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + data_size, b"WAVE", b"fmt ", 16, 1, channels,
+                       frequency, frequency * channels * 2, channels * 2, 16, b"data", data_size)
+
+
+def write_wav(buffer, pcm, frequency):
+    """Write pcm as a WAV into a writable buffer of at least WAV_HEADER_SIZE + pcm.nbytes bytes, e.g. shared memory."""
+    buffer[:WAV_HEADER_SIZE] = wav_header(pcm, frequency)
+    np.ndarray(pcm.shape, dtype="<i2", buffer=buffer, offset=WAV_HEADER_SIZE)[:] = pcm
+
+
+def to_wav_bytes(pcm, frequency):
+    """Wrap int16 playback samples in a WAV header, so pygame.mixer.music can play them from memory.
+
+    The samples are copied once, straight into the result."""
+    return b"".join((wav_header(pcm, frequency), memoryview(np.ascontiguousarray(pcm, dtype="<i2")).cast("B")))
@@ -0,0 +1,37 @@
+"""Song time taken from the mixer's playback position instead of the wall clock."""
+import time
+import pygame
+
+RESYNC_THRESHOLD = 0.1  # seconds of disagreement after which the clock jumps straight to the mixer
+SMOOTHING = 0.05  # share of the disagreement corrected each time the mixer position moves
+
+
+class AudioClock:
+    """Song time of the audio the player is hearing right now.
+
+    pygame.mixer.music.get_pos() only moves when the mixer pulls another
+    buffer, so on its own it advances in buffer-sized steps. The clock runs
+    on time.perf_counter() and gets nudged toward the mixer position every
+    time that moves. The position counts audio handed to the device, so the
+    output latency (one mixer buffer) and the calibrated audio offset are
+    taken off to get what is actually coming out of the speakers."""
+
+    def __init__(self, output_latency=0.0, audio_offset=0.0):
+        self.output_latency = output_latency
+        self.audio_offset = audio_offset
+        self.start()
+
+    def start(self):
+        """Restart at song time 0, call right after the music started playing."""
+        self._anchor_wall = time.perf_counter()
+        self._anchor_song = 0.0
+        self._last_position = None
+
+    def time(self):
+        now = time.perf_counter()
+        position = pygame.mixer.music.get_pos()  # ms, -1 when nothing is playing
+        if position >= 0 and position != self._last_position:
+            self._last_position = position
+            error = position / 1000 - (self._anchor_song + now - self._anchor_wall)
+            self._anchor_song += error if abs(error) > RESYNC_THRESHOLD else error * SMOOTHING
+        return self._anchor_song + now - self._anchor_wall - self.output_latency - self.audio_offset
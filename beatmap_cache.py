@@ -0,0 +1,115 @@
+"""On-disk cache of analysed beatmaps so a song only has to be analysed once."""
+import hashlib
+import os
+import struct
+import numpy as np
+from charts import ONSET_DTYPE
+
+CACHE_DIR = "cache"
+CACHE_SIZE_LIMIT = 64 * 1024 * 1024  # bytes kept on disk before the oldest entries get evicted
+
+# bump this whenever the analysis pipeline changes so old beatmaps stop matching
+ANALYSIS_VERSION = 4
+
+# entry layout: magic, analysis version, tempo, duration, onset count, then the ONSET_DTYPE records
+_MAGIC = b"BDBM"
+_HEADER = struct.Struct("<4sHddI")
+_ENTRY_SUFFIX = ".bdm"
+
+# (path, size, mtime) -> content hash, so replaying a song doesn't re-read the whole file
+_hash_memo = {}
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Return the sha1 of the file's content."""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key in _hash_memo:
+        return _hash_memo[memo_key]
+
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    _hash_memo[memo_key] = digest.hexdigest()
+    return _hash_memo[memo_key]
+
+
+def cache_key(content_hash, delta, pre_max, post_max, auto):
+    """Build the key of a beatmap from the song's content and the analysis parameters."""
+    raw = f"{ANALYSIS_VERSION}:{content_hash}:{float(delta)!r}:{float(pre_max)!r}:{float(post_max)!r}:{bool(auto)}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _entry_path(key):
+    return os.path.join(CACHE_DIR, key + _ENTRY_SUFFIX)
+
+
+def load(key):
+    """Return (onsets, tempo, duration) for a cached beatmap, or None on a miss."""
+    path = _entry_path(key)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    if len(data) < _HEADER.size:
+        return None
+    magic, version, tempo, duration, count = _HEADER.unpack_from(data)
+    if magic != _MAGIC or version != ANALYSIS_VERSION or len(data) != _HEADER.size + count * ONSET_DTYPE.itemsize:
+        return None
+
+    onsets = np.frombuffer(data, dtype=ONSET_DTYPE, count=count, offset=_HEADER.size).copy()
+
+    # mark as recently used, eviction drops the least recently used entries first
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return onsets, tempo, duration
+
+
+def store(key, onsets, tempo, duration):
+    """Write a beatmap to the cache, then trim the cache back under its size limit."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    onsets = np.asarray(onsets, dtype=ONSET_DTYPE)
+    tempo = float(np.atleast_1d(tempo)[0])
+
+    path = _entry_path(key)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, ANALYSIS_VERSION, tempo, float(duration), onsets.size))
+        f.write(onsets.tobytes())
+    os.replace(tmp_path, path)  # readers never see a half written entry
+
+    evict()
+
+
+def evict(limit=CACHE_SIZE_LIMIT):
+    """Delete the least recently used entries until the cache fits in `limit` bytes."""
+    try:
+        names = [name for name in os.listdir(CACHE_DIR) if name.endswith(_ENTRY_SUFFIX)]
+    except OSError:
+        return
+
+    entries = []
+    total = 0
+    for name in names:
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
@@ -0,0 +1,174 @@
+"""Speed, memory and accuracy of the onset analysis on generated audio with known onsets.
+
+Generates click tracks and small synthetic songs (kick, hi-hat and chord
+stabs) at known tempos, runs analysis.analyze_song on them at each analysis
+sample rate and parameter set, and reports the resampling and analysis
+wall times, peak memory (numpy allocations included, through tracemalloc,
+in a separate untimed run) and onset precision, recall and F-measure
+against the generated onsets.
+
+    python benchmarks/analysis_bench.py
+    python benchmarks/analysis_bench.py --sample-rates 22050 11025 --tempos 90 174"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import librosa
+import numpy as np
+import analysis
+import audio
+
+GENERATE_SR = 44100  # signals are made at this rate and resampled to each analysis rate, like a decoded song
+MATCH_WINDOW = 0.05  # a detected onset this close to a true one counts as a hit, the usual onset evaluation window
+
+# keyword arguments for analysis.analyze_song
+PARAMETER_SETS = {
+    "auto": {"auto": True},
+    "fixed": {"auto": False},
+    "fixed-strict": {"auto": False, "delta": 0.35, "pre_max": 14, "post_max": 14},
+}
+
+
+def click_track(tempo, seconds, sr=GENERATE_SR):
+    """Short 1 kHz clicks on every beat, returns (y, onset_times)."""
+    onsets = np.arange(0.5, seconds - 0.5, 60.0 / tempo)
+    y = np.zeros(int(seconds * sr), dtype=np.float32)
+    t = np.arange(int(0.02 * sr)) / sr
+    click = 0.8 * np.sin(2 * np.pi * 1000 * t) * np.exp(-t * 250)
+    for onset in onsets:
+        start = int(onset * sr)
+        y[start:start + click.size] += click[:y.size - start]
+    return y, onsets
+
+
+def synthetic_song(tempo, seconds, seed=0, sr=GENERATE_SR):
+    """Kick on the beats, hi-hats on some off-beats and chord stabs on some beats, returns (y, onset_times)."""
+    rng = np.random.default_rng(seed)
+    beat = 60.0 / tempo
+    y = np.zeros(int(seconds * sr), dtype=np.float32)
+    onsets = []
+
+    def add(start_time, sound, onset=True):
+        start = int(start_time * sr)
+        y[start:start + sound.size] += sound[:y.size - start]
+        if onset:
+            onsets.append(start_time)
+
+    t = np.arange(int(0.25 * sr)) / sr
+    kick = 0.9 * np.sin(2 * np.pi * (50 + 100 * np.exp(-t * 30)) * t) * np.exp(-t * 12)
+    hat_length = int(0.05 * sr)
+    chord = sum(np.sin(2 * np.pi * f * t) for f in (220.0, 277.2, 329.6)) * 0.25 * np.exp(-t * 8) * np.minimum(1.0, t * 400)
+
+    for beat_time in np.arange(0.5, seconds - 0.5, beat):
+        add(beat_time, kick)
+        if rng.random() < 0.3:
+            add(beat_time, chord, onset=False)  # same onset as the kick
+        off_beat = beat_time + beat / 2
+        if off_beat < seconds - 0.5 and rng.random() < 0.6:
+            add(off_beat, 0.3 * rng.standard_normal(hat_length) * np.exp(-np.arange(hat_length) / sr * 80))
+    return np.clip(y, -1.0, 1.0), np.sort(np.asarray(onsets))
+
+
+def match_onsets(reference, estimated, window=MATCH_WINDOW):
+    """Number of estimated onsets matched one-to-one to reference onsets within window, greedily in time order."""
+    matched = 0
+    i = j = 0
+    while i < reference.size and j < estimated.size:
+        difference = estimated[j] - reference[i]
+        if abs(difference) <= window:
+            matched += 1
+            i += 1
+            j += 1
+        elif difference < 0:
+            j += 1
+        else:
+            i += 1
+    return matched
+
+
+def f_measure(reference, estimated, window=MATCH_WINDOW):
+    """(precision, recall, f) of estimated onsets against reference onsets."""
+    matched = match_onsets(reference, estimated, window)
+    precision = matched / estimated.size if estimated.size else 0.0
+    recall = matched / reference.size if reference.size else 0.0
+    f = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f
+
+
+def run_case(y, reference, sample_rate, params):
+    """Resample and analyse one signal, returns the report row.
+
+    The analysis is timed in a run of its own and its peak memory measured
+    in a second one, tracemalloc tracing every allocation would slow the
+    timed run down. Resampling from the generation rate is timed apart, it
+    stands in for decoding and isn't part of analyze_song."""
+    start = time.perf_counter()
+    y_analysis = librosa.resample(y, orig_sr=GENERATE_SR, target_sr=sample_rate)
+    resample = time.perf_counter() - start
+
+    timings = {}
+    start = time.perf_counter()
+    onsets, tempo, _ = analysis.analyze_song(y_analysis, sample_rate, timings=timings, **params)
+    wall = time.perf_counter() - start
+
+    tracemalloc.start()
+    analysis.analyze_song(y_analysis, sample_rate, **params)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    precision, recall, f = f_measure(reference, onsets["time"])
+    return {
+        "wall": wall,
+        "resample": resample,
+        "peak_mb": peak / 2**20,
+        "tempo": float(np.atleast_1d(tempo)[0]),
+        "precision": precision,
+        "recall": recall,
+        "f": f,
+        "timings": timings,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the onset analysis on generated audio with known onsets.")
+    parser.add_argument("--sample-rates", type=int, nargs="+", default=[audio.ANALYSIS_SR, 16000, 11025])
+    parser.add_argument("--tempos", type=float, nargs="+", default=[90, 120, 150, 174])
+    parser.add_argument("--params", nargs="+", default=list(PARAMETER_SETS), choices=list(PARAMETER_SETS))
+    parser.add_argument("--seconds", type=float, default=60, help="length of each generated signal")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    signals = []
+    for tempo in args.tempos:
+        signals.append((f"clicks@{tempo:g}", *click_track(tempo, args.seconds)))
+        signals.append((f"song@{tempo:g}", *synthetic_song(tempo, args.seconds, args.seed)))
+
+    # the first analysis in a process pays for numba compiling librosa's kernels, keep that out of the timings
+    y = signals[0][1]
+    for params in PARAMETER_SETS.values():
+        analysis.analyze_song(librosa.resample(y, orig_sr=GENERATE_SR, target_sr=audio.ANALYSIS_SR), audio.ANALYSIS_SR, **params)
+
+    print(f"{'signal':<14}{'params':<14}{'sr':>6}{'resample':>9}{'time s':>9}{'peak MB':>9}{'tempo':>8}{'P':>7}{'R':>7}{'F':>7}")
+    totals = {}
+    for name, y, reference in signals:
+        for sample_rate in args.sample_rates:
+            for params_name in args.params:
+                row = run_case(y, reference, sample_rate, PARAMETER_SETS[params_name])
+                print(f"{name:<14}{params_name:<14}{sample_rate:>6}{row['resample']:9.3f}{row['wall']:9.3f}{row['peak_mb']:9.1f}{row['tempo']:8.1f}"
+                      f"{row['precision']:7.3f}{row['recall']:7.3f}{row['f']:7.3f}")
+                total = totals.setdefault((params_name, sample_rate), {"wall": 0.0, "f": [], "peak_mb": 0.0})
+                total["wall"] += row["wall"]
+                total["f"].append(row["f"])
+                total["peak_mb"] = max(total["peak_mb"], row["peak_mb"])
+
+    print("\nper parameter set and sample rate:")
+    for (params_name, sample_rate), total in totals.items():
+        print(f"{params_name:<14}{sample_rate:>6}  total {total['wall']:.2f} s  peak {total['peak_mb']:.1f} MB  mean F {np.mean(total['f']):.3f}")
+
+
+if __name__ == "__main__":
+    main()
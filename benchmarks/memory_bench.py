@@ -0,0 +1,81 @@
+"""Peak memory of getting a song ready to play, the game's way against the original one.
+
+Each mode runs in a fresh process and reports that process's peak RSS and
+what it still holds once the song is ready (what stays resident while the
+song plays):
+
+    baseline  librosa.load at 22050 Hz mono + analysis, playback streams from disk
+    decode    audio.decode + analysis + the in-memory WAV, all in one process
+    prefetch  the game process's side of Prefetcher, the decoding and analysis run in its worker
+
+    python benchmarks/memory_bench.py songs/some-song.mp3
+
+Needs the resource module, so Linux or macOS."""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODES = ("baseline", "decode", "prefetch")
+MIXER = (44100, 2)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10  # bytes on macOS, KiB on Linux
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return float("nan")
+
+
+def run_mode(mode, audio_path):
+    import numpy  # noqa: F401, imported before the starting RSS is read so every mode pays for it the same
+    start_rss = current_rss_mb()
+    if mode == "baseline":
+        import librosa
+        import analysis
+        y, sr = librosa.load(audio_path)
+        analysis.analyze_song(y, sr)
+        del y
+        held = None
+    elif mode == "decode":
+        import analysis
+        import audio
+        pcm, y, sr = audio.decode(audio_path, *MIXER)
+        analysis.analyze_song(y, sr)
+        del y
+        held = audio.to_wav_bytes(pcm, MIXER[0])
+        del pcm
+    else:
+        from prefetch import Prefetcher
+        prefetcher = Prefetcher(*MIXER)
+        prefetcher.request(audio_path)
+        held, _ = prefetcher.take(audio_path)
+        prefetcher.cancel()
+    print(f"{mode:<10} peak {peak_rss_mb():8.1f} MB  held {current_rss_mb() - start_rss:8.1f} MB  "
+          f"song bytes {len(held) / 2**20 if held is not None else 0:8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the peak memory of preparing a song for playback.")
+    parser.add_argument("audio_path")
+    parser.add_argument("--mode", choices=MODES, help="run one mode in this process (used internally)")
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.audio_path)
+        return
+    for mode in MODES:
+        subprocess.run([sys.executable, os.path.abspath(__file__), args.audio_path, "--mode", mode], check=True)
+
+
+if __name__ == "__main__":
+    main()
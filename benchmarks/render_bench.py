@@ -0,0 +1,217 @@
+"""Headless benchmark of the gameplay loop on synthetic charts.
+
+Runs the same per-frame work as a song in main.py (input events, the fixed
+step simulation, dirty-rect note drawing, HUD text, display update) under
+SDL's dummy video and audio drivers, so it needs no display, no sound card
+and no songs. Song time is simulated at a fixed frame rate and frames are
+not paced, so the numbers are the cost of a frame, not the frame cap.
+
+Charts get as long as a song would need for their note count at a dense
+but playable rate (--density), and one stretch of play from the middle of
+each song is timed (--play-seconds), so a bigger chart means a longer song
+to keep track of, not more notes on screen at once.
+
+    python benchmarks/render_bench.py                   # run and compare with the baseline
+    python benchmarks/render_bench.py --save-baseline   # run and store the results as the new baseline
+
+Baselines are only comparable on the machine they were recorded on."""
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pygame
+from engine import GameEngine, DIFFICULTY_SETTINGS
+from notes import NoteChart
+from profiler import FrameProfiler
+from renderer import Renderer, circle_sprite
+from text_cache import TextCache
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "render_baseline.json")
+CHART_SIZES = (1_000, 10_000, 100_000)
+NOTE_DENSITY = 8  # notes per song second, about a dense hard chart
+PLAY_SECONDS = 60  # song seconds timed per case
+REGRESSION_THRESHOLD = 0.15  # flag results this much slower than the baseline
+
+# same layout as main.py
+SCREEN_SIZE = (800, 600)
+TARGET_Y = 550
+TARGET_RADIUS = 30
+NOTE_RADIUS = 15
+LANE_KEYS = {pygame.K_LEFT: -1, pygame.K_SPACE: 0, pygame.K_RIGHT: 1}
+LANE_KEY = {lane: key for key, lane in LANE_KEYS.items()}
+
+
+def synthetic_chart(note_count, duration, lanes, rng):
+    """note_count onset times spread randomly over duration seconds, each in a random lane."""
+    times = np.sort(rng.uniform(0.5, duration, note_count))
+    return times, rng.choice(lanes, note_count)
+
+
+def scripted_presses(times, lanes, hit_offset, rng, jitter=0.02, wrong_rate=0.05):
+    """(press_time, lane) for every note, off by a bit of timing jitter, plus some presses at random times."""
+    press_times = times + hit_offset + rng.normal(0.0, jitter, times.size)
+    wrong = int(times.size * wrong_rate)
+    press_times = np.concatenate((press_times, rng.uniform(times[0], times[-1] + hit_offset, wrong)))
+    press_lanes = np.concatenate((lanes, rng.choice(np.unique(lanes), wrong)))
+    order = np.argsort(press_times, kind="stable")
+    return press_times[order], press_lanes[order]
+
+
+def run_case(screen, fonts, difficulty, note_count, density, play_seconds, frame_rate, seed):
+    settings = DIFFICULTY_SETTINGS[difficulty]
+    beat_speed = settings["beat_speed"]
+    rng = np.random.default_rng(seed)
+
+    song_seconds = max(note_count / density, 1.0)
+    times, lanes = synthetic_chart(note_count, song_seconds, settings["targets"], rng)
+    note_start_y = TARGET_Y - beat_speed * 1.5
+    chart = NoteChart(times, lanes, note_start_y)
+    engine = GameEngine(chart, settings["tolerance"], beat_speed, TARGET_Y, -NOTE_RADIUS, settings["max_combo"])
+    press_times, press_lanes = scripted_presses(times, lanes, engine.judge.hit_offset, rng)
+
+    # skip ahead to the timed stretch untimed, the notes before it go by as misses
+    seconds = min(play_seconds, song_seconds)
+    start_time = (song_seconds - seconds) / 2
+    engine.advance_to(start_time)
+    next_press = int(np.searchsorted(press_times, start_time))
+
+    score_font, combo_font = fonts
+    text_cache = TextCache()
+    renderer = Renderer(screen)
+    background = pygame.Surface(SCREEN_SIZE).convert()
+    background.fill((15, 15, 15))
+    renderer.set_background(background)
+    note_sprite = circle_sprite((255, 0, 0), NOTE_RADIUS)
+
+    frames = int(seconds * frame_rate)
+    profiler = FrameProfiler(window=frames)
+    pygame.event.clear()
+    start = time.perf_counter()
+    for frame in range(frames + 1):
+        profiler.begin_frame()
+        if frame == frames:
+            break  # the begin_frame above closed the last frame
+        current_time = start_time + frame / frame_rate
+        renderer.clear()
+        profiler.mark("draw")
+
+        # scripted input goes through the event queue like real key presses
+        while next_press < press_times.size and press_times[next_press] <= current_time:
+            pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=LANE_KEY[int(press_lanes[next_press])], press_time=float(press_times[next_press])))
+            next_press += 1
+        for event in pygame.event.get():
+            if event.type == pygame.KEYDOWN and event.key in LANE_KEYS:
+                engine.press(LANE_KEYS[event.key], event.press_time)
+        profiler.mark("events")
+
+        progress_width = int((SCREEN_SIZE[0] - 20) * current_time / song_seconds)
+        renderer.fill((100, 100, 100), (SCREEN_SIZE[0] / 2 - progress_width / 2, SCREEN_SIZE[1] - 10, progress_width, 10))
+        profiler.mark("draw")
+
+        engine.advance_to(current_time)
+        profiler.mark("update")
+        visible = chart.visible()
+        for lane, y in zip(chart.lanes[visible], chart.positions(visible, current_time, beat_speed)):
+            renderer.blit(note_sprite, (400 + TARGET_RADIUS * 2.5 * lane - NOTE_RADIUS, int(y) - NOTE_RADIUS))
+        profiler.mark("draw")
+
+        if engine.combo_show_time > 0:
+            combo_text = text_cache.render(combo_font, f"{engine.combo_multiplier}x", (127, 127, 127))
+            renderer.blit(combo_text, combo_text.get_rect(center=(SCREEN_SIZE[0] / 2, 50)))
+        renderer.blit(text_cache.render(score_font, f"Score: {engine.score}/{engine.max_score}", (255, 255, 255)), (10, 10))
+        profiler.mark("text")
+
+        renderer.present()
+        profiler.mark("present")
+    elapsed = time.perf_counter() - start
+
+    frame_times = np.asarray(profiler.frame_times) * 1000
+    result = {
+        "frames": frames,
+        "seconds": elapsed,
+        "fps": frames / elapsed,
+        "realtime": seconds / elapsed,  # song seconds simulated per wall clock second
+        "song_seconds": song_seconds,
+        "mean_ms": float(frame_times.mean()),
+        "p50_ms": float(np.percentile(frame_times, 50)),
+        "p95_ms": float(np.percentile(frame_times, 95)),
+        "p99_ms": float(np.percentile(frame_times, 99)),
+        "max_ms": float(frame_times.max()),
+        "phases_p95_ms": {phase: p95 for phase, (_, p95, _) in profiler.phase_stats().items() if phase != "frame"},
+        "judgments": dict(engine.judge.counts),
+    }
+    return result
+
+
+def compare(results, baseline, threshold):
+    """One line per case whose mean or p95 frame time got more than threshold slower than the baseline."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in ("mean_ms", "p95_ms"):
+            if result[metric] > base[metric] * (1 + threshold):
+                regressions.append(f"{name} {metric}: {base[metric]:.3f} -> {result[metric]:.3f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the gameplay loop headless on synthetic charts.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(CHART_SIZES), help="chart sizes in notes")
+    parser.add_argument("--difficulties", nargs="+", default=list(DIFFICULTY_SETTINGS), choices=list(DIFFICULTY_SETTINGS))
+    parser.add_argument("--density", type=float, default=NOTE_DENSITY, help="notes per song second, sets each chart's song length")
+    parser.add_argument("--play-seconds", type=float, default=PLAY_SECONDS, help="song seconds timed per case, from the middle of the song")
+    parser.add_argument("--frame-rate", type=int, default=60, help="simulated frames per song second")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="allowed slowdown, 0.15 is 15%%")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    pygame.init()
+    screen = pygame.display.set_mode(SCREEN_SIZE)
+    fonts = (pygame.font.Font(None, 36), pygame.font.Font(None, 45))
+
+    results = {}
+    for difficulty in args.difficulties:
+        for size in args.sizes:
+            name = f"{difficulty}/{size}"
+            result = run_case(screen, fonts, difficulty, size, args.density, args.play_seconds, args.frame_rate, args.seed)
+            results[name] = result
+            print(f"{name:<16} {result['fps']:9.0f} fps {result['realtime']:7.1f}x realtime   "
+                  f"p50 {result['p50_ms']:.3f}  p95 {result['p95_ms']:.3f}  p99 {result['p99_ms']:.3f}  max {result['max_ms']:.3f} ms")
+    pygame.quit()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare with, run with --save-baseline first.")
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print("No regressions against the baseline.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
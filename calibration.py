@@ -0,0 +1,117 @@
+"""Calibration: measures how late the player hears the audio and how late their key presses land.
+
+Two rounds of tapping SPACE along with a steady beat. The first round only
+flashes a circle, so the taps measure the input offset (display + keyboard
++ reaction). The second round only plays clicks, its taps measure the same
+plus whatever audio latency the mixer clock doesn't already account for,
+the difference is the audio offset."""
+import io
+import statistics
+import time
+import numpy as np
+import pygame
+import audio
+from audio_clock import AudioClock
+from timed_input import TimedInput
+
+CALIBRATION_INTERVAL = 0.6  # seconds between beats
+CALIBRATION_BEATS = 16
+CALIBRATION_LEAD_IN = 1.8  # seconds before the first beat
+MATCH_WINDOW = 0.3  # taps further than this from every beat are ignored
+FLASH_LENGTH = 0.1
+
+
+def beat_times():
+    return CALIBRATION_LEAD_IN + CALIBRATION_INTERVAL * np.arange(CALIBRATION_BEATS)
+
+
+def click_track_wav(frequency, channels):
+    """The calibration beats as short 1 kHz clicks, in a WAV for pygame.mixer.music."""
+    length = int((beat_times()[-1] + CALIBRATION_INTERVAL) * frequency)
+    samples = np.zeros(length, dtype=np.float32)
+    t = np.arange(int(0.015 * frequency)) / frequency
+    click = 0.8 * np.sin(2 * np.pi * 1000 * t) * np.exp(-t * 300)
+    for beat_time in beat_times():
+        start = int(beat_time * frequency)
+        samples[start:start + click.size] += click
+    return audio.to_wav_bytes(audio.to_pcm(samples[np.newaxis, :], frequency, frequency, channels), frequency)
+
+
+def median_offset(tap_times, beats):
+    """Median of each tap's distance to its nearest beat, or None with too few usable taps."""
+    errors = []
+    for tap_time in tap_times:
+        nearest = beats[np.argmin(np.abs(beats - tap_time))]
+        if abs(tap_time - nearest) <= MATCH_WINDOW:
+            errors.append(tap_time - nearest)
+    if len(errors) < len(beats) // 2:
+        return None
+    return statistics.median(errors)
+
+
+def run_round(screen, font, clock, fps, title, wav=None, output_latency=0.0):
+    """Play one round of beats, flashing them when there's no wav, and return the SPACE tap times.
+
+    Returns None when the player cancels with ESC or closes the window."""
+    audio_clock = AudioClock(output_latency)
+    timed_input = TimedInput(audio_clock.time)
+    beats = beat_times()
+    end_time = beats[-1] + CALIBRATION_INTERVAL
+    center = (screen.get_width() // 2, screen.get_height() // 2)
+
+    if wav is not None:
+        pygame.mixer.music.load(io.BytesIO(wav), "wav")
+        pygame.mixer.music.play()
+    audio_clock.start()
+
+    taps = []
+    while True:
+        frame_start = time.perf_counter()
+        now = audio_clock.time()
+        for event, event_time in timed_input.take():
+            if event.type == pygame.QUIT:
+                pygame.event.post(event)  # let the game loop see it too
+                pygame.mixer.music.stop()
+                return None
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    pygame.mixer.music.stop()
+                    return None
+                if event.key == pygame.K_SPACE:
+                    taps.append(event_time)
+        if now >= end_time:
+            break
+
+        screen.fill((0, 0, 0))
+        title_text = font.render(title, True, (255, 255, 255))
+        screen.blit(title_text, title_text.get_rect(center=(center[0], 100)))
+        taps_text = font.render(f"taps: {len(taps)}", True, (127, 127, 127))
+        screen.blit(taps_text, taps_text.get_rect(center=(center[0], 500)))
+        if wav is None and np.any((now >= beats) & (now < beats + FLASH_LENGTH)):
+            pygame.draw.circle(screen, (255, 255, 255), center, 40)
+        pygame.display.flip()
+
+        timed_input.poll_until(frame_start + 1 / fps)
+        clock.tick(fps)
+
+    pygame.mixer.music.stop()
+    return taps
+
+
+def calibrate(screen, font, clock, fps, output_latency, mixer_frequency, mixer_channels):
+    """Run both rounds, returns (audio_offset, input_offset) in seconds or None if it didn't work out."""
+    taps = run_round(screen, font, clock, fps, "tap SPACE on every flash")
+    if taps is None:
+        return None
+    input_offset = median_offset(taps, beat_times())
+    if input_offset is None:
+        return None
+
+    wav = click_track_wav(mixer_frequency, mixer_channels)
+    taps = run_round(screen, font, clock, fps, "tap SPACE on every click", wav, output_latency)
+    if taps is None:
+        return None
+    heard_offset = median_offset(taps, beat_times())
+    if heard_offset is None:
+        return None
+    return heard_offset - input_offset, input_offset
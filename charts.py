@@ -0,0 +1,82 @@
+"""Difficulty charts, all derived from the one onset list a song's analysis produces.
+
+Every onset comes with the frequency band that rose the most at it and its
+strength. A difficulty keeps the onsets that are strong enough and not too
+close to the previous note, and puts each one in a lane picked by its band,
+low on the left and high on the right. Nothing is random, so a song always
+gets the same charts."""
+import numpy as np
+from engine import DIFFICULTY_SETTINGS
+
+# one analysed onset: time in seconds, band 0 (low) .. BAND_COUNT - 1 (high), strength in [0, 1]
+ONSET_DTYPE = np.dtype([("time", "<f8"), ("band", "u1"), ("strength", "<f4")])
+BAND_COUNT = 3
+
+# min_gap: seconds from the previous note in the chart, min_strength: weaker onsets are dropped
+CHART_DENSITY = {
+    "easy": {"min_gap": 0.4, "min_strength": 0.3},
+    "normal": {"min_gap": 0.25, "min_strength": 0.15},
+    "hard": {"min_gap": 0.15, "min_strength": 0.05},
+    "extreme": {"min_gap": 0.0, "min_strength": 0.0},
+}
+
+
+def empty_onsets():
+    return np.empty(0, dtype=ONSET_DTYPE)
+
+
+def band_lanes(bands, targets, previous=None):
+    """Lanes for onsets by their band, the bands spread evenly from the leftmost lane to the rightmost.
+
+    A band that falls between two lanes (the middle one on two-lane charts)
+    goes to the one of them the note before isn't in, so its notes alternate
+    and both lanes get their share. previous is the lane of the chart's last
+    note so far, for onsets appended to a chart that already exists. Nothing
+    but the notes themselves decides, so a chart gets the same lanes whether
+    it was built in one go or in pieces."""
+    targets = np.asarray(sorted(targets))
+    position = bands.astype(np.float64) * (len(targets) - 1) / (BAND_COUNT - 1)
+    low = targets[np.floor(position).astype(np.intp)]
+    high = targets[np.ceil(position).astype(np.intp)]
+    lanes = low.copy()
+    for i in np.flatnonzero(low != high):
+        before = lanes[i - 1] if i > 0 else previous
+        lanes[i] = low[i] if before == high[i] else high[i]
+    return lanes
+
+
+def build_chart(onsets, difficulty, after=-np.inf, previous_lane=None):
+    """(times, lanes) of the difficulty's chart from analysed onsets.
+
+    after and previous_lane are the time and lane of the chart's last note so
+    far, for onsets appended to a chart that already exists (long songs
+    arrive in pieces)."""
+    density = CHART_DENSITY[difficulty]
+    onsets = onsets[onsets["strength"] >= density["min_strength"]]
+
+    keep = np.zeros(onsets.size, dtype=bool)
+    last = after
+    for i, onset_time in enumerate(onsets["time"]):
+        if onset_time - last >= density["min_gap"]:
+            keep[i] = True
+            last = onset_time
+    onsets = onsets[keep]
+    return onsets["time"], band_lanes(onsets["band"], DIFFICULTY_SETTINGS[difficulty]["targets"], previous_lane)
+
+
+def build_charts(onsets):
+    """{difficulty: (times, lanes)} for every difficulty."""
+    return {difficulty: build_chart(onsets, difficulty) for difficulty in DIFFICULTY_SETTINGS}
+
+
+def extend_charts(song_charts, onsets):
+    """Add newly analysed onsets to every chart of build_charts(), returns the new part of each."""
+    added = {}
+    for difficulty, (times, lanes) in song_charts.items():
+        if times.size:
+            new_times, new_lanes = build_chart(onsets, difficulty, times[-1], lanes[-1])
+        else:
+            new_times, new_lanes = build_chart(onsets, difficulty)
+        song_charts[difficulty] = (np.concatenate((times, new_times)), np.concatenate((lanes, new_lanes)))
+        added[difficulty] = (new_times, new_lanes)
+    return added
@@ -0,0 +1,117 @@
+"""Game rules of one song (scoring, combo, misses), advanced in fixed steps of song time.
+
+Nothing in here depends on how often frames are drawn: misses and timers
+move in steps of 1 / SIMULATION_RATE seconds of song time and presses are
+judged at their own timestamps, so a slow frame can't change the result.
+Nothing in here needs pygame either, see simulate.py for running songs
+without a window."""
+import numpy as np
+from judgment import JudgmentEngine, hit_windows
+from notes import MISSED
+
+SIMULATION_RATE = 240  # simulation steps per second of song time
+
+# how long the score stays coloured after a press and the combo stays on screen after a hit,
+# these used to be 75 and 100 frames at 60 FPS
+SCORE_FLASH_TIME = 75 / 60
+COMBO_SHOW_TIME = 100 / 60
+
+HIT_POINTS = 10  # times the combo multiplier
+HIT_MAX_POINTS = 75
+MISS_MAX_POINTS = 100
+WRONG_PRESS_PENALTY = 10
+
+# tolerance in pixels, beat_speed in pixels per second, the lanes notes can fall in and the combo cap
+DIFFICULTY_SETTINGS = {
+    "easy": {"tolerance": 45, "beat_speed": 100, "targets": [0], "max_combo": 15},
+    "normal": {"tolerance": 35, "beat_speed": 155, "targets": [-1, 1], "max_combo": 10},
+    "hard": {"tolerance": 35, "beat_speed": 200, "targets": [-1, 0, 1], "max_combo": 7},
+    "extreme": {"tolerance": 30, "beat_speed": 230, "targets": [-1, 0, 1], "max_combo": 5},
+}
+
+
+class GameEngine:
+    """Score and note state of one song.
+
+    chart is a NoteChart whose start_y is where notes are at their onset
+    time; notes fall at beat_speed pixels per second, reach the target at
+    target_y and are missed tolerance pixels past it. top_y is where notes
+    come into view."""
+
+    def __init__(self, chart, tolerance, beat_speed, target_y, top_y, max_combo_multiplier, rate=SIMULATION_RATE):
+        self.chart = chart
+        self.beat_speed = beat_speed
+        self.top_y = top_y
+        self.miss_y = target_y + tolerance
+        self.max_combo_multiplier = max_combo_multiplier
+        self.judge = JudgmentEngine(chart, hit_windows(tolerance, beat_speed), (target_y - chart.start_y) / beat_speed)
+        self.step_length = 1.0 / rate
+
+        self.time = 0.0  # song time the simulation has reached
+        self.score = 0
+        self.max_score = 0
+        self.combo_multiplier = 1
+        self.score_flash = None  # "hit" or "wrong" while the score is coloured
+        self.score_flash_time = 0.0
+        self.combo_show_time = 0.0
+        self.hits = {}  # note index -> (grade, timing error) of every hit note
+
+    def advance_to(self, song_time):
+        """Run whole steps until the simulation is less than one step behind song_time.
+
+        Between presses nothing but misses and timers happen, and running n
+        steps at once ends in the same state as n single steps, so it's one
+        jump however far behind the simulation is."""
+        steps = int((song_time - self.time) / self.step_length)
+        if steps > 0:
+            self._advance(steps)
+        return max(steps, 0)
+
+    def step(self):
+        self._advance(1)
+
+    def _advance(self, steps):
+        elapsed = steps * self.step_length
+        self.time += elapsed
+        missed = self.chart.update(self.time, self.beat_speed, self.top_y, self.miss_y)
+        if missed:
+            self.judge.counts["miss"] += missed
+            self.max_score += MISS_MAX_POINTS * missed
+            self.combo_multiplier = 1
+
+        self.combo_show_time = max(0.0, self.combo_show_time - elapsed)
+        self.score_flash_time = max(0.0, self.score_flash_time - elapsed)
+        if self.score_flash_time == 0:
+            self.score_flash = None
+
+    def press(self, lane, press_time):
+        """Judge and score a key press in lane at song time press_time, returns the grade or None."""
+        # anything that was missed before the press has to count as missed first
+        self.advance_to(press_time)
+
+        grade = self.judge.judge(lane, press_time)
+        if grade is not None:
+            self.hits[self.judge.last_index] = (grade, self.judge.last_error)
+            if self.combo_multiplier < self.max_combo_multiplier:
+                self.combo_multiplier += 1
+            self.score += HIT_POINTS * self.combo_multiplier
+            self.max_score += HIT_MAX_POINTS
+            self.combo_show_time = COMBO_SHOW_TIME
+            self.score_flash = "hit"
+        else:
+            self.combo_multiplier = 1
+            self.score -= WRONG_PRESS_PENALTY
+            self.score_flash = "wrong"
+        self.score_flash_time = SCORE_FLASH_TIME
+        return grade
+
+    def judgments(self):
+        """(grades, errors) per note of the chart: the grade, "miss" or "" while still pending, and the
+        timing error in seconds of the hit notes (NaN for the rest)."""
+        grades = np.full(len(self.chart), "", dtype="<U8")
+        grades[self.chart.state == MISSED] = "miss"
+        errors = np.full(len(self.chart), np.nan)
+        for index, (grade, error) in self.hits.items():
+            grades[index] = grade
+            errors[index] = error
+        return grades, errors
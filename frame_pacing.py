@@ -0,0 +1,42 @@
+"""Rolling frame-time statistics."""
+import time
+from collections import deque
+
+
+def percentile(ordered, fraction):
+    return ordered[int(fraction * (len(ordered) - 1))]
+
+
+class FramePacer:
+    """Keeps the last `window` frame intervals, call tick() once per frame.
+
+    profiler.FrameProfiler builds its per-phase timings on this, the game
+    ticks that one."""
+
+    def __init__(self, window=240):
+        self.frame_times = deque(maxlen=window)
+        self._last = None
+
+    def tick(self):
+        """Close the frame since the last tick, returns its length in seconds (None on the first tick)."""
+        now = time.perf_counter()
+        interval = None
+        if self._last is not None:
+            interval = now - self._last
+            self.frame_times.append(interval)
+        self._last = now
+        return interval
+
+    def stats(self):
+        """fps and frame-time mean/p95/p99/max in milliseconds over the window, empty before two ticks."""
+        if not self.frame_times:
+            return {}
+        ordered = sorted(self.frame_times)
+        mean = sum(ordered) / len(ordered)
+        return {
+            "fps": 1.0 / mean if mean > 0 else 0.0,
+            "mean_ms": mean * 1000,
+            "p95_ms": percentile(ordered, 0.95) * 1000,
+            "p99_ms": percentile(ordered, 0.99) * 1000,
+            "max_ms": ordered[-1] * 1000,
+        }
@@ -0,0 +1,81 @@
+"""Hit judgment: per-lane queues over a NoteChart so a key press only looks at one note.
+
+Presses are judged in time: the press's own timestamp against the moment the
+note reaches the target, so the result doesn't depend on the frame rate."""
+import numpy as np
+from notes import ACTIVE
+
+# hit windows as fractions of the difficulty's tolerance, tightest first; "good" covers the whole tolerance
+HIT_WINDOW_FRACTIONS = (("perfect", 0.3), ("great", 0.65), ("good", 1.0))
+
+
+def hit_windows(tolerance, beat_speed, fractions=HIT_WINDOW_FRACTIONS):
+    """Turn window fractions into (grade, max timing error in seconds) pairs.
+
+    tolerance is in pixels, the time it takes a note to fall that far is the full window."""
+    return tuple((grade, tolerance / beat_speed * fraction) for grade, fraction in fractions)
+
+
+class JudgmentEngine:
+    """Judges key presses against a NoteChart.
+
+    Each lane keeps the indices of its notes in time order and a pointer to
+    the next note that can still be judged. Notes in a lane arrive in that
+    order, so a press only ever has to look at the note under the pointer."""
+
+    def __init__(self, chart, windows, hit_offset):
+        self.chart = chart
+        self.windows = windows  # ((grade, max timing error), ...) tightest first
+        self.hit_offset = hit_offset  # seconds from a note's onset time until it reaches the target
+        self.last_error = None  # timing error of the last hit, negative when early
+        self.last_index = None  # chart index of the last hit note
+        self.counts = {grade: 0 for grade, _ in windows}
+        self.counts["miss"] = 0
+        self.rebuild()
+
+    def rebuild(self):
+        """Recreate the lane queues, needed after notes were appended to the chart."""
+        self.queues = {}
+        self.next = {}
+        for lane in np.unique(self.chart.lanes):
+            queue = np.flatnonzero(self.chart.lanes == lane)
+            pending = np.flatnonzero(self.chart.state[queue] == ACTIVE)
+            self.queues[int(lane)] = queue
+            self.next[int(lane)] = int(pending[0]) if pending.size else queue.size
+
+    def grade(self, error):
+        """The tightest window the timing error falls in, or None when it's outside all of them."""
+        for grade, max_error in self.windows:
+            if abs(error) <= max_error:
+                return grade
+        return None
+
+    def judge(self, lane, press_time):
+        """Judge a press in lane at song time press_time.
+
+        Returns the grade of the note it hit, or None for a wrong press."""
+        queue = self.queues.get(lane)
+        if queue is None:
+            return None
+
+        # skip the notes that were hit or missed since the last press, and the ones this press is
+        # already too late for (the next chart update counts those as misses)
+        latest = press_time - self.hit_offset - self.windows[-1][1]
+        pointer = self.next[lane]
+        while pointer < queue.size and (self.chart.state[queue[pointer]] != ACTIVE or self.chart.times[queue[pointer]] < latest):
+            pointer += 1
+        self.next[lane] = pointer
+        if pointer == queue.size:
+            return None
+
+        index = queue[pointer]
+        error = press_time - (self.chart.times[index] + self.hit_offset)
+        grade = self.grade(error)
+        if grade is None:
+            return None
+        self.chart.score(index)
+        self.next[lane] = pointer + 1
+        self.counts[grade] += 1
+        self.last_error = error
+        self.last_index = int(index)
+        return grade
@@ -0,0 +1,200 @@
+"""Song library index, kept in library.json so the songs folder isn't re-scanned and songs aren't re-probed every time.
+
+Each song has its size and mtime, to notice when the file changed, and its
+duration, tempo and analysis status (with the ANALYSIS_VERSION it was
+analysed under) once the song has been analysed."""
+import json
+import os
+import threading
+import time
+import numpy as np
+from beatmap_cache import ANALYSIS_VERSION
+
+LIBRARY_PATH = "library.json"
+SONGS_DIR = "songs"
+
+# what the decoder (soundfile, or audioread/ffmpeg behind librosa) reads, matched case-insensitively
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".ogg", ".flac", ".opus", ".m4a", ".aac", ".aiff", ".aif", ".wma")
+
+RESTAT_INTERVAL = 2.0  # seconds between passes re-statting the songs, an edit in place doesn't touch the folder
+RESTAT_BATCH = 32  # songs re-statted per refresh() call, so a big library spreads a pass over many frames
+SAVE_INTERVAL = 5.0  # seconds changes are batched for before library.json is rewritten
+
+NEW = "new"  # not analysed yet
+ANALYSED = "analysed"
+
+
+def is_song(name):
+    return name.lower().endswith(AUDIO_EXTENSIONS)
+
+
+class Library:
+    """The songs in songs_dir, in name order, with an entry of what's known about each.
+
+    refresh() rescans the folder when the folder itself changed (a song
+    added, removed or renamed). Otherwise it re-stats RESTAT_BATCH of the
+    known songs per call, a pass at most every RESTAT_INTERVAL seconds, to
+    catch songs edited in place. It never re-reads them. A song whose size or
+    mtime changed goes back to NEW.
+
+    Changes are written to library.json at most every SAVE_INTERVAL seconds,
+    on a background thread so the game loop calling refresh() never waits
+    for the disk. Call flush() before exiting so the last ones aren't lost.
+    Entries are replaced, never changed in place, which is what lets the
+    save thread write a plain copy of the dict."""
+
+    def __init__(self, songs_dir=SONGS_DIR, path=LIBRARY_PATH):
+        self.songs_dir = songs_dir
+        self.path = path
+        self.songs = []  # song paths, sorted
+        self.entries = {}  # path -> {"size", "mtime", "duration", "tempo", "status"}
+        self._dir_mtime = None
+        self._restat_time = 0.0
+        self._restat_next = 0  # index in songs the running re-stat pass continues at, 0 between passes
+        self._dirty = False
+        self._save_time = 0.0
+        self._save_thread = None
+        self._load()
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __getitem__(self, index):
+        return self.songs[index]
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return
+        if stored.get("songs_dir") == self.songs_dir:
+            self.entries = stored.get("entries", {})
+            self.songs = sorted(self.entries)
+
+    def save(self):
+        """Write library.json now, waiting for a background save that's still running."""
+        if self._save_thread is not None:
+            self._save_thread.join()
+            self._save_thread = None
+        self._write(dict(self.entries))
+        self._dirty = False
+        self._save_time = time.monotonic()
+
+    def flush(self):
+        """Save what changed since the last save, if anything did."""
+        if self._dirty:
+            self.save()
+        elif self._save_thread is not None:
+            self._save_thread.join()
+            self._save_thread = None
+
+    def _write(self, entries):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"songs_dir": self.songs_dir, "entries": entries}, f)
+        os.replace(tmp_path, self.path)
+
+    def _save_if_due(self):
+        """Start a background save of the changes once SAVE_INTERVAL has passed since the last one."""
+        if not self._dirty or time.monotonic() - self._save_time < SAVE_INTERVAL:
+            return
+        if self._save_thread is not None:
+            if self._save_thread.is_alive():
+                return
+            self._save_thread = None
+
+        def run(entries):
+            try:
+                self._write(entries)
+            except OSError as e:
+                print(f"Failed to save {self.path}: {e}")
+
+        self._save_thread = threading.Thread(target=run, args=(dict(self.entries),), name="library-save", daemon=True)
+        self._save_thread.start()
+        self._dirty = False
+        self._save_time = time.monotonic()
+
+    def refresh(self, force=False):
+        """Bring the index up to date with the folder, returns True when the song list or an entry changed."""
+        try:
+            dir_mtime = os.stat(self.songs_dir).st_mtime_ns
+        except OSError:
+            dir_mtime = None
+        if not force and dir_mtime == self._dir_mtime:
+            changed = self._restat_some()
+            self._save_if_due()
+            return changed
+        self._dir_mtime = dir_mtime
+        self._restat_time = time.monotonic()
+        self._restat_next = 0
+
+        found = {}
+        try:
+            with os.scandir(self.songs_dir) as scan:
+                for entry in scan:
+                    if is_song(entry.name) and entry.is_file():
+                        stat = entry.stat()
+                        # keep the glob style "songs/name" paths, they're also the beatmap cache's memo keys
+                        found[os.path.join(self.songs_dir, entry.name)] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            pass
+
+        changed = found.keys() != self.entries.keys()
+        entries = {}
+        for path, (size, mtime) in found.items():
+            entry, replaced = self._checked_entry(path, size, mtime)
+            changed |= replaced
+            entries[path] = entry
+        self.entries = entries
+        self.songs = sorted(entries)
+        self._dirty |= changed
+        self._save_if_due()
+        return changed
+
+    def _restat_some(self):
+        """Check the next RESTAT_BATCH known songs for edits in place, the folder listing itself is unchanged."""
+        if self._restat_next == 0:
+            now = time.monotonic()
+            if now - self._restat_time < RESTAT_INTERVAL:
+                return False
+            self._restat_time = now
+        batch = self.songs[self._restat_next:self._restat_next + RESTAT_BATCH]
+        self._restat_next += len(batch)
+        if self._restat_next >= len(self.songs):
+            self._restat_next = 0
+        changed = False
+        for path in batch:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self._dir_mtime = None  # gone after all, rescan next time
+                continue
+            self.entries[path], replaced = self._checked_entry(path, stat.st_size, stat.st_mtime_ns)
+            changed |= replaced
+        self._dirty |= changed
+        return changed
+
+    def _checked_entry(self, path, size, mtime):
+        """(entry, replaced): the song's entry, a fresh NEW one if the file changed since."""
+        entry = self.entries.get(path)
+        if entry is not None and entry["size"] == size and entry["mtime"] == mtime:
+            return entry, False
+        return {"size": size, "mtime": mtime, "duration": None, "tempo": None, "status": NEW}, True
+
+    def is_analysed(self, path):
+        """True when the song was analysed by this analysis version and hasn't changed since, as of the last refresh()."""
+        entry = self.entries.get(path)
+        return entry is not None and entry["status"] == ANALYSED and entry.get("version") == ANALYSIS_VERSION
+
+    def record_analysis(self, path, tempo, duration):
+        """Remember what a song's analysis found out about it."""
+        entry = self.entries.get(path)
+        if entry is None:
+            return
+        tempo = float(np.atleast_1d(tempo)[0])
+        if self.is_analysed(path) and entry["tempo"] == tempo and entry["duration"] == float(duration):
+            return
+        self.entries[path] = dict(entry, tempo=tempo, duration=float(duration), status=ANALYSED, version=ANALYSIS_VERSION)
+        self._dirty = True
+        self._save_if_due()
@@ -1,512 +1,488 @@
-import pygame
 import time
-import librosa
+STARTUP_TIME = time.perf_counter()  # for the time-to-first-frame report
+import pygame
 import math
-import glob
 import win11toast
 import os
-import random
-import requests
 import sys
-import numpy as np
-from librosa.util.exceptions import ParameterError
-from librosa.onset import onset_backtrack
-
-# Define current release version
-release_version = "v1.1.0"
-
-# GitHub repository details
-GITHUB_REPO = "jacs121/beat-down"
-LATEST_RELEASE_API = f"https://api.github.com/repos/{GITHUB_REPO}/releases/latest"
-
-def check_for_update():
-    try:
-        response = requests.get(LATEST_RELEASE_API, timeout=5)
-        response.raise_for_status()
-        latest_release = response.json()
-        
-        latest_version = latest_release["tag_name"]
-        download_url = latest_release["assets"][0]["browser_download_url"]
-
-        if latest_version != release_version:
-            win11toast.toast(
-                "Update Available",
-                f"A new version ({latest_version}) is available. Click to download.",
-                on_click=lambda: download_update(download_url, latest_version)
-            )
-    except Exception as e:
-        print(f"Failed to check for updates: {e}")
-
-def download_update(url, latest_version):
-    """Download the latest version and close the game after completion."""
-    exe_path = os.path.join(os.getcwd(), f"beat down - {latest_version}.exe")  # Save as "beat down - {version}.exe"
-    try:
-        response = requests.get(url, stream=True)
-        with open(exe_path, "wb") as f:
-            for chunk in response.iter_content(1024):
-                f.write(chunk)
-        
-        win11toast.toast("Download Complete", "The latest version has been downloaded. you can now use the new file.")
-
-        # Close the game after downloading
-        sys.exit(0)
-    except Exception as e:
-        print(f"Download failed: {e}")
-
-# Run update check if script is in executable mode
-if getattr(sys, 'frozen', False):  # Checks if running as an exe
-    check_for_update()
-
+import multiprocessing
+import io
+import calibration
+import charts
+import settings
+from audio_clock import AudioClock
+from notes import NoteChart
+from engine import GameEngine, DIFFICULTY_SETTINGS
+from profiler import FrameProfiler, stage
+from timed_input import TimedInput
+from text_cache import TextCache
+from renderer import Renderer, circle_sprite
+from prefetch import Prefetcher
+from library import Library
+import updater
+# analysis (librosa, numba, scipy) is never imported here, the prefetch workers analyse songs in
+# their own processes, so the window doesn't wait for it
 
 songI = -1
-def get_adaptive_parameters(tempo, onset_env, sr):
-    # normalize the envelope to [0,1]
-    if onset_env.max() > 0:
-        onset_env = onset_env / np.max(onset_env)
-
-    # dynamic range
-    dynamic_range = np.max(onset_env) - np.min(onset_env)
-
-    # a more modest delta
-    #    – 75th percentile of the *normalized* envelope is in [0,1]
-    #    – scale it by a constant in [0.5, 0.8] instead of multiplying back by the big dynamic_range
-    perc75 = np.percentile(onset_env, 75)
-    delta  = perc75 * (0.65 + 0.25 * (1 - dynamic_range))
-
-    # beat-based windows (unchanged)
-    beat_interval   = 60.0 / tempo
-    frames_per_beat = int(beat_interval * sr / 512)
-    
-    print(delta)
-
-    return {
-        'delta':    delta,
-        'pre_max':  int(frames_per_beat * 1.5),
-        'post_max': int(frames_per_beat * 1.5),
-        'pre_avg':  max(3, int(frames_per_beat * 0.7)),
-        'post_avg': max(3, int(frames_per_beat * 0.7)),
-        'wait':     max(1, int(frames_per_beat * 0.3)),
-    }
-
 def cycleSong(delta=0.22, pre_max=10.5, post_max=10.5, auto:bool = True):
-    global songI
-    song_files = sorted(glob.glob("songs/*.MP3"))
+    global songI, load_error
+    library.refresh()
     
-    if not song_files:
+    if not library.songs:
         win11toast.toast("Beat Rhythm - no songs available", "Please add songs to the songs folder.")
         sys.exit()
     
-    songI = (songI + 1) % len(song_files)
-    audio_path = song_files[songI]
+    songI = (songI + 1) % len(library)
+    audio_path = library[songI]
     
     pygame.display.set_caption(f"Beat down - waiting...")
     print(f"Loading {audio_path}...")
     
-    # Load audio and extract features
-    y, sr = librosa.load(audio_path, sr=None)
-    onset_env = librosa.onset.onset_strength(y=y, sr=sr)
-    tempo, _ = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr)
-    
-    # Parameter selection
-    if auto:
-        params = get_adaptive_parameters(tempo, onset_env, sr)
-    else:
-        params = {
-            'delta': delta,
-            'pre_max': int(pre_max),
-            'post_max': int(post_max),
-            'pre_avg': 5,
-            'post_avg': 5,
-            'wait': 2
-        }
-
-    # Detect onsets with selected parameters
-    raw_frames = librosa.onset.onset_detect(
-        y=y,
-        sr=sr,
-        delta=params['delta'],
-        pre_max=params['pre_max'],
-        post_max=params['post_max'],
-        pre_avg=params['pre_avg'],
-        post_avg=params['post_avg'],
-        wait=params['wait'],
-        backtrack=False,
-        onset_envelope=onset_env
-    )
-    
-    if raw_frames.size > 0:
-        try:
-            onset_frames = onset_backtrack(raw_frames, onset_env)
-        except ParameterError:
-            onset_frames = raw_frames
-    else:
-        onset_frames = raw_frames
-        
-    # Convert results
-    onset_times = librosa.frames_to_time(onset_frames, sr=sr)
-    song_duration = librosa.get_duration(y=y, sr=sr)
+    # Use the background preparation of this song if there is one, waiting for it if it's still running.
+    # If it was busy with some other song, have it prepare this one now: the worker is what streams
+    # long songs in bounded memory, and it leaves a long song that's still streaming to finish
+    timings = {}
+    with stage(timings, "wait"):
+        result = prefetcher.take(audio_path, delta, pre_max, post_max, auto)
+        if result is None:
+            prefetcher.request(audio_path, delta, pre_max, post_max, auto)
+            result = prefetcher.take(audio_path, delta, pre_max, post_max, auto)
+    if result is None:
+        # one song that won't decode shouldn't end the game, the menu shows why and C moves on past it
+        load_error = f"couldn't load {song_title(audio_path)}: {prefetcher.error or 'unknown error'}"
+        pygame.display.set_caption("Beat down")
+        return None
+    load_error = None
+    timings.update(prefetcher.timings)
+    profiler.record_analysis(audio_path, timings)
+    song_wav, (song_onsets, tempo, song_duration) = result  # decoded once, replays reuse it
+    del result
+    library.record_analysis(audio_path, tempo, song_duration)
+    song_charts = charts.build_charts(song_onsets)  # every difficulty at once, switching needs no new analysis
     end_trigger_time = song_duration - 10  # 10 seconds before end
     
     pygame.display.set_caption(f"Beat down - {os.path.basename(audio_path)}")
     
-    return end_trigger_time, onset_times, audio_path, song_duration
-
-if not os.path.exists("songs"):
-    os.mkdir("songs")
-
-if len(glob.glob("songs/*.MP3")) == 0:
-    win11toast.toast("Beat Rhythm - no songs available", "please add songs by adding them to songs folder")
-    sys.exit()
-
-# Colors
-WHITE = (255, 255, 255)
-LIGHT_GRAY = (127, 127, 127)
-GRAY = (100, 100, 100)
-DARK_GRAY = (15, 15, 15)
-BLACK = (0, 0, 0)
-
-RED = (255, 0, 0)
-GREEN = (0, 255, 0)
-YELLOW = (255, 255, 0)
-BLUE = (0, 0, 255)
-
-DARK_RED = (127, 0, 0)
-DARK_GREEN = (0, 127, 0)
-DARK_YELLOW = (127, 127, 0)
-DARK_BLUE = (0, 0, 127)
-
-# Initialize pygame
-pygame.init()
-screen = pygame.display.set_mode((800, 600))
-# Target zone settings
-target_y = 550
-target_radius = 30
-target0_color = GREEN
-target1_color = YELLOW
-target2_color = BLUE
-next_song_color = WHITE
-score = 0
-maxScore = 0
-
-score_font = pygame.font.Font(None, 36)
-end_font = pygame.font.Font(None, 48)  # Font for end screen text
-combo_multiplier_font = pygame.font.Font(None, 45)
-targets_font = pygame.font.Font(None, 25)
-info_font = pygame.font.Font(None, 20)
-
-pygame.display.set_caption("Beat down")
-
-score_color = WHITE
-score_color_cooldown = 0
-menu_screen = True  # Variable to track if end screen should be displayed
-
-targets_active = []
-songList = sorted(glob.glob("songs/*.MP3"))
-difficulty = "normal"
-tolerance = 40
-beat_speed = 155  # Speed at which onsets move down the screen (pixels per second)
-targets_active = [-1, 1]
-max_combo_multiplier = 10
-
-DIFFICULTY_SETTINGS = {
-    "easy": {"tolerance": 45, "beat_speed": 100, "targets": [0], "max_combo": 15},
-    "normal": {"tolerance": 35, "beat_speed": 155, "targets": [-1, 1], "max_combo": 10},
-    "hard": {"tolerance": 35, "beat_speed": 200, "targets": [-1, 0, 1], "max_combo": 7},
-    "extreme": {"tolerance": 30, "beat_speed": 230, "targets": [-1, 0, 1], "max_combo": 5},
-}
-
-def change_difficulty(level="normal"):
-    global tolerance, beat_speed, targets_active, max_combo_multiplier, difficulty
-    difficulty = level
-    settings = DIFFICULTY_SETTINGS[level]
-    tolerance = settings["tolerance"]
-    beat_speed = settings["beat_speed"]
-    targets_active = settings["targets"]
-    max_combo_multiplier = settings["max_combo"]
-
-DIFFICULTIES = ["easy", "normal", "hard", "extreme"]
-def cycle_difficulty(direction=1):
-    global difficulty
-    idx = DIFFICULTIES.index(difficulty) + direction
-    difficulty = DIFFICULTIES[max(0, min(idx, len(DIFFICULTIES) - 1))]
-    change_difficulty(difficulty)
-
-combo_multiplier = 1
-combo_multiplier_show_cooldown = 0
-
-
-# Game settings
-clock = pygame.time.Clock()
-fps = 60
-beat_start = time.time()  # Start time to sync the onsets
-onsets = []
-audio_path = songList[0]
-force_next_song = False
-
-# Game loop
-start_menu = True
-running = True
-while running:
-    current_time = time.time() - beat_start
-    if menu_screen:
-        # Display the end screen
-        screen.fill(BLACK)
-
-        # Calculate positions to center text
-        score_percentage = math.floor(100 * ((score / maxScore) if score > 0 else 0))
+    return end_trigger_time, song_charts, audio_path, song_duration, song_wav
+
+update_download = None  # the running or finished updater.UpdateDownload, shown on the menu
+load_error = None  # why the last song couldn't be loaded, shown on the menu
+
+def show_update(latest_version, download_url, size, sha256):
+    """Offer an update found by the background check, clicking it downloads it in the background."""
+    def download():
+        global update_download
+        if update_download is None or (update_download.done and update_download.error):
+            update_download = updater.UpdateDownload(download_url, updater.update_path(latest_version), size, sha256).start()
+    win11toast.toast(
+        "Update Available",
+        f"A new version ({latest_version}) is available. Click to download.",
+        on_click=download
+    )
+
+def song_title(audio_path):
+    return os.path.splitext(os.path.basename(audio_path))[0]
+
+def song_details(audio_path):
+    """Title plus length and tempo when the library knows them."""
+    entry = library.entries.get(audio_path, {})
+    if entry.get("duration") is None:
+        return song_title(audio_path)
+    minutes, seconds = divmod(int(entry["duration"]), 60)
+    return f"{song_title(audio_path)} ({minutes}:{seconds:02d}, {entry['tempo']:.0f} BPM)"
+
+def play_song(audio_path, song_wav):
+    pygame.mixer.music.stop()
+    if song_wav is not None:
+        pygame.mixer.music.load(io.BytesIO(song_wav), "wav")
+    else:  # long songs stream from disk instead of sitting decoded in memory
+        pygame.mixer.music.load(audio_path)
+    pygame.mixer.music.play()
+
+# worker processes re-import this file, only the real launch may start the game
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+
+    if not os.path.exists("songs"):
+        os.mkdir("songs")
+
+    library = Library()
+    library.refresh(force=True)
+    if len(library) == 0:
+        win11toast.toast("Beat Rhythm - no songs available", "please add songs by adding them to songs folder")
+        sys.exit()
+
+    # Colors
+    WHITE = (255, 255, 255)
+    LIGHT_GRAY = (127, 127, 127)
+    GRAY = (100, 100, 100)
+    DARK_GRAY = (15, 15, 15)
+    BLACK = (0, 0, 0)
+
+    RED = (255, 0, 0)
+    GREEN = (0, 255, 0)
+    YELLOW = (255, 255, 0)
+    BLUE = (0, 0, 255)
+
+    DARK_RED = (127, 0, 0)
+    DARK_GREEN = (0, 127, 0)
+    DARK_YELLOW = (127, 127, 0)
+    DARK_BLUE = (0, 0, 127)
+
+    # Initialize pygame
+    player_settings = settings.load()
+    # the decoded songs are int16, keep the mixer in that format
+    pygame.mixer.pre_init(44100, -16, 2, player_settings["mixer_buffer"])
+    pygame.init()
+    if player_settings["vsync"]:
+        screen = pygame.display.set_mode((800, 600), pygame.SCALED, vsync=1)
+    else:
+        screen = pygame.display.set_mode((800, 600))
+    # Target zone settings
+    target_y = 550
+    target_radius = 30
+    note_radius = 15
+    target0_color = GREEN
+    target1_color = YELLOW
+    target2_color = BLUE
+    next_song_color = WHITE
+
+    score_font = pygame.font.Font(None, 36)
+    end_font = pygame.font.Font(None, 48)  # Font for end screen text
+    combo_multiplier_font = pygame.font.Font(None, 45)
+    targets_font = pygame.font.Font(None, 25)
+    info_font = pygame.font.Font(None, 20)
+    text_cache = TextCache()
+
+    # the target labels never change, render them once
+    lane_labels = {-1: targets_font.render("LEFT", True, BLACK), 0: targets_font.render("SPACE", True, BLACK), 1: targets_font.render("RIGHT", True, BLACK)}
+
+    # circles are pre-rendered once and blitted, the playfield is redrawn only where it changed
+    DIRTY_RECT_RENDERING = True
+    renderer = Renderer(screen, dirty=DIRTY_RECT_RENDERING)
+    note_sprite = circle_sprite(RED, note_radius)
+    target_sprites = {color: circle_sprite(color, target_radius) for color in (GREEN, YELLOW, BLUE, GRAY)}
+
+    pygame.display.set_caption("Beat down")
+
+    SCORE_FLASH_COLORS = {"hit": (0, 255, 0), "wrong": (255, 0, 0)}
+    menu_screen = True  # Variable to track if end screen should be displayed
+
+    targets_active = []
+    difficulty = "normal"
+    tolerance = 40
+    beat_speed = 155  # Speed at which onsets move down the screen (pixels per second)
+    targets_active = [-1, 1]
+    max_combo_multiplier = 10
+
+    def change_difficulty(level="normal"):
+        global tolerance, beat_speed, targets_active, max_combo_multiplier, difficulty
+        difficulty = level
+        settings = DIFFICULTY_SETTINGS[level]
+        tolerance = settings["tolerance"]
+        beat_speed = settings["beat_speed"]
+        targets_active = settings["targets"]
+        max_combo_multiplier = settings["max_combo"]
+
+    def draw_targets(surface):
+        for lane, color in ((-1, target0_color), (0, target1_color), (1, target2_color)):
+            center = (400 + target_radius*2.5*lane, target_y)
+            if lane in targets_active:
+                surface.blit(target_sprites[color], target_sprites[color].get_rect(center=center))
+                # show a text on each active target
+                surface.blit(lane_labels[lane], lane_labels[lane].get_rect(center=center))
+            else:
+                surface.blit(target_sprites[GRAY], target_sprites[GRAY].get_rect(center=center))
+
+    def gameplay_background():
+        background = pygame.Surface(screen.get_size()).convert()
+        background.fill(DARK_GRAY)
+        draw_targets(background)
+        return background
+
+    DIFFICULTIES = ["easy", "normal", "hard", "extreme"]
+    def cycle_difficulty(direction=1):
+        global difficulty
+        idx = DIFFICULTIES.index(difficulty) + direction
+        difficulty = DIFFICULTIES[max(0, min(idx, len(DIFFICULTIES) - 1))]
+        change_difficulty(difficulty)
+
+    # Game settings
+    clock = pygame.time.Clock()
+    fps = player_settings["frame_rate"]  # 0 means uncapped
+    profiler = FrameProfiler()  # also the frame pacing stats
+    show_profiler = player_settings["show_profiler"]  # F3 toggles the overlay, F4 starts/stops a trace file
+    onsets = NoteChart([], [], target_y)
+    engine = GameEngine(onsets, tolerance, beat_speed, target_y, -note_radius, max_combo_multiplier)
+    LANE_KEYS = {pygame.K_LEFT: -1, pygame.K_SPACE: 0, pygame.K_RIGHT: 1}
+    # song time follows the mixer, minus one buffer of output latency and the calibrated offset
+    audio_clock = AudioClock(player_settings["mixer_buffer"] / pygame.mixer.get_init()[0], player_settings["audio_offset"])
+    timed_input = TimedInput(audio_clock.time)
+    audio_path = library[0]
+    force_next_song = False
+    song_wav = None
+    mixer_frequency, _, mixer_channels = pygame.mixer.get_init()
+    prefetcher = Prefetcher(mixer_frequency, mixer_channels)
+
+    # Run update check if script is in executable mode, on a thread so the menu doesn't wait for it
+    if getattr(sys, 'frozen', False):  # Checks if running as an exe
+        updater.check_in_background(show_update)
+
+    # Game loop
+    first_frame_time = None
+    start_menu = True
+    running = True
+    while running:
+        frame_start = time.perf_counter()
+        profiler.begin_frame()
+        current_time = audio_clock.time()
+        if menu_screen:
+            # Start analysing the queued song now so pressing start doesn't have to wait for it,
+            # unless a long song's chart is still streaming in for a restart. Not before the first
+            # frame is up, starting the worker shouldn't delay it
+            library.refresh()  # one stat of the songs folder, the songs themselves every couple of seconds
+            if not start_menu and song_wav is None and prefetcher.job is not None and prefetcher.job[0] == audio_path:
+                # the rest of a long song's chart can finish streaming in while the menu is up, keep it for R
+                # before the next song's request drops it
+                streamed_onsets = prefetcher.take_onsets()
+                if streamed_onsets.size:
+                    charts.extend_charts(song_charts, streamed_onsets)
+            if not prefetcher.streaming and first_frame_time is not None:
+                prefetcher.request(library[(songI+1) % len(library)])
+            if prefetcher.poll():
+                _, (_, tempo, song_duration) = prefetcher.result
+                library.record_analysis(prefetcher.job[0], tempo, song_duration)
+
+            # Display the end screen
+            screen.fill(BLACK)
+
+            # Calculate positions to center text
+            score_percentage = math.floor(100 * ((engine.score / engine.max_score) if engine.score > 0 else 0))
         
-        difficulty_text = combo_multiplier_font.render(difficulty.upper(), True, WHITE)
-        difficulty_rect = difficulty_text.get_rect(center=(screen.get_width() / 2, 50))
+            difficulty_text = text_cache.render(combo_multiplier_font, difficulty.upper(), WHITE)
+            difficulty_rect = difficulty_text.get_rect(center=(screen.get_width() / 2, 50))
         
-        info1_text = info_font.render(f"target hit tolerance: {tolerance}", True, WHITE)
-        info1_rect = info1_text.get_rect(left=screen.get_rect().left)
-        info1_rect.bottom = 20
+            info1_text = text_cache.render(info_font, f"target hit tolerance: {tolerance}", WHITE)
+            info1_rect = info1_text.get_rect(left=screen.get_rect().left)
+            info1_rect.bottom = 20
         
-        info2_text = info_font.render(f"circles speed: {beat_speed}", True, WHITE)
-        info2_rect = info2_text.get_rect(left=screen.get_rect().left)
-        info2_rect.bottom = 40
+            info2_text = text_cache.render(info_font, f"circles speed: {beat_speed}", WHITE)
+            info2_rect = info2_text.get_rect(left=screen.get_rect().left)
+            info2_rect.bottom = 40
         
-        info3_text = info_font.render(f"max combos: {max_combo_multiplier}", True, WHITE)
-        info3_rect = info3_text.get_rect(left=screen.get_rect().left)
-        info3_rect.bottom = 60
+            info3_text = text_cache.render(info_font, f"max combos: {max_combo_multiplier}", WHITE)
+            info3_rect = info3_text.get_rect(left=screen.get_rect().left)
+            info3_rect.bottom = 60
+
+            info4_text = text_cache.render(info_font, f"audio offset: {player_settings['audio_offset'] * 1000:.0f} ms, input offset: {player_settings['input_offset'] * 1000:.0f} ms (K to calibrate)", WHITE)
+            info4_rect = info4_text.get_rect(left=screen.get_rect().left)
+            info4_rect.bottom = 80
         
-        next_song_text = info_font.render(f"next up: {".".join(os.path.basename(songList[(songI+1) % len(songList)]).split(".")[:-1])}", True, next_song_color)
-        next_song_rect = next_song_text.get_rect(left=screen.get_rect().left)
-        next_song_rect.bottom = screen.get_rect().bottom
+            next_song_text = text_cache.render(info_font, f"next up: {song_details(library[(songI+1) % len(library)])}", next_song_color)
+            next_song_rect = next_song_text.get_rect(left=screen.get_rect().left)
+            next_song_rect.bottom = screen.get_rect().bottom
+
+            if update_download is not None:
+                if not update_download.done:
+                    progress = update_download.progress()
+                    update_line = f"downloading update: {progress:.0%}" if progress is not None else f"downloading update: {update_download.downloaded // 2**20} MB"
+                elif update_download.error:
+                    update_line = f"update download failed: {update_download.error}"
+                else:
+                    update_line = f"update downloaded: {os.path.basename(update_download.path)}, you can now use the new file"
+                update_text = text_cache.render(info_font, update_line, YELLOW)
+                screen.blit(update_text, update_text.get_rect(left=0, bottom=next_song_rect.top - 5))
+            if load_error is not None:
+                load_error_text = text_cache.render(info_font, load_error, YELLOW)
+                screen.blit(load_error_text, load_error_text.get_rect(left=0, bottom=next_song_rect.top - 25))
         
 
-        if start_menu:
-            end_text = end_font.render("beat down", True, WHITE)
-        else:
-            end_text = end_font.render("Game Over!" if score_percentage < 75 else "you won", True, WHITE)
-        end_text_rect = end_text.get_rect(center=(screen.get_width() // 2, 200))
-        if not start_menu:
-            end_comment_text = score_font.render("you can do better" if score_percentage < 50 else "really good" if score_percentage >= 50 and score_percentage < 75 else "awesome" if score_percentage >= 75 and score_percentage < 100 else "perfection", True, WHITE)
-            end_comment_text_rect = end_comment_text.get_rect(center=(screen.get_width() // 2, 250))
+            if start_menu:
+                end_text = text_cache.render(end_font, "beat down", WHITE)
+            else:
+                end_text = text_cache.render(end_font, "Game Over!" if score_percentage < 75 else "you won", WHITE)
+            end_text_rect = end_text.get_rect(center=(screen.get_width() // 2, 200))
+            if not start_menu:
+                end_comment_text = text_cache.render(score_font, "you can do better" if score_percentage < 50 else "really good" if score_percentage >= 50 and score_percentage < 75 else "awesome" if score_percentage >= 75 and score_percentage < 100 else "perfection", WHITE)
+                end_comment_text_rect = end_comment_text.get_rect(center=(screen.get_width() // 2, 250))
 
-            score_text = score_font.render(f"Final Score: {score} ({score_percentage}%)", True, WHITE)
-            score_text_rect = score_text.get_rect(center=(screen.get_width() // 2, 300))
+                score_text = text_cache.render(score_font, f"Final Score: {engine.score} ({score_percentage}%)", WHITE)
+                score_text_rect = score_text.get_rect(center=(screen.get_width() // 2, 300))
 
-            restart_text = score_font.render("Press R to Restart or C to continue", True, WHITE)
-            
-            # Draw the texts with centered positions
-            screen.blit(score_text, score_text_rect)
-            screen.blit(end_comment_text, end_comment_text_rect)
-        else:
-            restart_text = score_font.render("press Enter to start", True, WHITE)
-        restart_text_rect = restart_text.get_rect(center=(screen.get_width() // 2, 400))
-
-        # Draw the rest of the texts with centered positions
-        screen.blit(end_text, end_text_rect)
-        screen.blit(restart_text, restart_text_rect)
-        screen.blit(restart_text, restart_text_rect)
-        screen.blit(difficulty_text, difficulty_rect)
-        screen.blit(info1_text, info1_rect)
-        screen.blit(info2_text, info2_rect)
-        screen.blit(info3_text, info3_rect)
-        screen.blit(next_song_text, next_song_rect)
+                judgments_text = text_cache.render(info_font, "   ".join(f"{grade}: {count}" for grade, count in engine.judge.counts.items()), WHITE)
+                judgments_text_rect = judgments_text.get_rect(center=(screen.get_width() // 2, 335))
 
-    else:
-        screen.fill(DARK_GRAY)
+                restart_text = text_cache.render(score_font, "Press R to Restart or C to continue", WHITE)
+            
+                # Draw the texts with centered positions
+                screen.blit(score_text, score_text_rect)
+                screen.blit(end_comment_text, end_comment_text_rect)
+                screen.blit(judgments_text, judgments_text_rect)
+            else:
+                restart_text = text_cache.render(score_font, "press Enter to start", WHITE)
+            restart_text_rect = restart_text.get_rect(center=(screen.get_width() // 2, 400))
+
+            # Draw the rest of the texts with centered positions
+            screen.blit(end_text, end_text_rect)
+            screen.blit(restart_text, restart_text_rect)
+            screen.blit(restart_text, restart_text_rect)
+            screen.blit(difficulty_text, difficulty_rect)
+            screen.blit(info1_text, info1_rect)
+            screen.blit(info2_text, info2_rect)
+            screen.blit(info3_text, info3_rect)
+            screen.blit(info4_text, info4_rect)
+            screen.blit(next_song_text, next_song_rect)
 
-    if score_color_cooldown > 0:
-        score_color_cooldown -= 1
-    else:
-        score_color = WHITE
-
-    # Event handling
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        elif event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_RIGHT and not menu_screen:
-                scored_hit = False
-                for onset in onsets:
-                    if onset['active'] and not onset['scored'] and onset['target_index'] == 1:
-                        # Check if the beat is within the target zone when Space is pressed
-                        if abs(target_y - onset['y_position']) <= tolerance:
-                            if combo_multiplier < max_combo_multiplier:
-                                combo_multiplier += 1
-                            score += 10 * combo_multiplier
-                            maxScore += 75
-                            combo_multiplier_show_cooldown = 100
-                            score_color_cooldown = 75
-                            score_color = (0, 255, 0)
-                            onset['scored'] = True
-                            onset['active'] = False
-                            scored_hit = True
-                            break
-                if not scored_hit and not menu_screen:
-                    combo_multiplier = 1
-                    score -= 10
-                    score_color_cooldown = 75
-                    score_color = (255, 0, 0)
-            elif event.key == pygame.K_LEFT and not menu_screen:
-                scored_hit = False
-                for onset in onsets:
-                    if onset['active'] and not onset['scored'] and onset['target_index'] == -1:
-                        # Check if the beat is within the target zone when Space is pressed
-                        if abs(target_y - onset['y_position']) <= tolerance:
-                            if combo_multiplier < max_combo_multiplier:
-                                combo_multiplier += 1
-                            score += 10 * combo_multiplier
-                            maxScore += 75
-                            combo_multiplier_show_cooldown = 100
-                            score_color_cooldown = 75
-                            score_color = (0, 255, 0)
-                            onset['scored'] = True
-                            onset['active'] = False
-                            scored_hit = True
-                            break
-                if not scored_hit and not menu_screen:
-                    combo_multiplier = 1
-                    score -= 10
-                    score_color_cooldown = 75
-                    score_color = (255, 0, 0)
-            elif event.key == pygame.K_SPACE:
-                scored_hit = False
-                for onset in onsets:
-                    if onset['active'] and not onset['scored'] and onset['target_index'] == 0:
-                        # Check if the beat is within the target zone when Space is pressed
-                        if abs(target_y - onset['y_position']) <= tolerance:
-                            if combo_multiplier < max_combo_multiplier:
-                                combo_multiplier += 1
-                            score += 10 * combo_multiplier
-                            maxScore += 75
-                            combo_multiplier_show_cooldown = 100
-                            score_color_cooldown = 75
-                            score_color = (0, 255, 0)
-                            onset['scored'] = True
-                            onset['active'] = False
-                            scored_hit = True
-                            break
-                if not scored_hit and not menu_screen:
-                    combo_multiplier = 1
-                    score -= 10
-                    score_color_cooldown = 75
-                    score_color = (255, 0, 0)
-            elif ((event.key == pygame.K_c and not start_menu) or (event.key == pygame.K_RETURN and start_menu)) and menu_screen:  # continue game
-                next_song_color = WHITE
-                # Reset necessary variables to restart the game
-                score = 0
-                maxScore = 0
-                end_trigger_time, onset_times, audio_path, song_duration = cycleSong()
-                target0_color = GREEN
-                target1_color = YELLOW
-                target2_color = BLUE
-                beat_speed = max(beat_speed, 10) if 'beat_speed' in locals() else 10  # Ensure valid beat_speed
-                onsets = [{'time': onset_time,
-                    'start_y': target_y - (beat_speed * 1.5) + 20,  # Start higher above the target
-                    'y_position': target_y - (beat_speed * 1.5) + 20,  # Ensures proper movement
-                    'active': True,
-                    'scored': False,
-                    'target_index': random.choice(targets_active) if targets_active else None}
-                    for onset_time in onset_times]
-                pygame.mixer.music.stop()
-                pygame.mixer.music.load(audio_path)
-                pygame.mixer.music.play()
-                beat_start = time.time() + 0.1  # Small offset to compensate for delay
-                current_time = 0
-                menu_screen = False  # Exit end screen mode
-                start_menu = False
-            elif event.key == pygame.K_r and menu_screen and not start_menu:  # restart game
-                next_song_color = WHITE
-                # Reset necessary variables to restart the game
-                score = 0
-                maxScore = 0
-                target0_color = GREEN
-                target1_color = YELLOW
-                target2_color = BLUE
-                beat_speed = max(beat_speed, 10) if 'beat_speed' in locals() else 10  # Ensure valid beat_speed
-                onsets = [{'time': onset_time,
-                    'start_y': target_y - (beat_speed * 1.5),  # Start higher above the target
-                    'y_position': target_y - (beat_speed * 1.5),  # Ensures proper movement
-                    'active': True,
-                    'scored': False,
-                    'target_index': random.choice(targets_active) if targets_active else None}
-                    for onset_time in onset_times]
-                pygame.mixer.music.stop()
-                pygame.mixer.music.load(audio_path)
-                pygame.mixer.music.play()
-                beat_start = time.time() + 0.1  # Small offset to compensate for delay
-                current_time = 0
-                menu_screen = False  # Exit end screen mode
-            elif event.key == pygame.K_UP and menu_screen:
-                cycle_difficulty(1)
-            elif event.key == pygame.K_DOWN and menu_screen:
-                cycle_difficulty(-1)
-            elif event.key == pygame.K_LEFT and menu_screen:
-                songI = (songI - 1) % len(songList)
-                force_next_song = True
-                next_song_color = YELLOW
-
-            elif event.key == pygame.K_RIGHT and menu_screen:
-                songI = (songI + 1) % len(songList)
-                force_next_song = True
-                next_song_color = YELLOW
-            elif event.key == pygame.K_ESCAPE and not menu_screen:
-                menu_screen = True
-                pygame.mixer.music.stop()
-                score = 0
-                maxScore = 0
-
-    if combo_multiplier_show_cooldown > 0 and not menu_screen:
-        combo_multiplier_show_cooldown -= 1
-        combo_multiplier_text = combo_multiplier_font.render(f"{combo_multiplier}x", True, LIGHT_GRAY)
-        combo_multiplier_rect = combo_multiplier_text.get_rect(center=(screen.get_width() / 2, 50))
-        screen.blit(combo_multiplier_text, combo_multiplier_rect)
-
-    # Draw the target zone
-    pygame.draw.circle(screen, target0_color if -1 in targets_active else GRAY, (400 - target_radius*2.5, target_y), target_radius)
-    pygame.draw.circle(screen, target1_color if 0 in targets_active else GRAY, (400, target_y), target_radius)
-    pygame.draw.circle(screen, target2_color if 1 in targets_active else GRAY, (400 + target_radius*2.5, target_y), target_radius)
-    if not menu_screen:
-        progress_ratio = current_time / (song_duration if song_duration > 0 else 1)
-        progress_width = int((screen.get_width() - 20) * progress_ratio)
-        pygame.draw.rect(screen, GRAY, ((screen.get_width()/2)-progress_width/2, screen.get_height() - 10, progress_width, 10))  # Progress bar at top
-
-    if -1 in targets_active:
-        # show a text for the yellow target
-        yellow_target_font = targets_font.render(f"LEFT", True, BLACK)
-        yellow_target_rect = yellow_target_font.get_rect(center=(400 - target_radius*2.5, target_y))
-        screen.blit(yellow_target_font, yellow_target_rect)
-
-    if 0 in targets_active:
-        # show a text for the green target
-        green_target_font = targets_font.render(f"SPACE", True, BLACK)
-        green_target_rect = green_target_font.get_rect(center=(400, target_y))
-        screen.blit(green_target_font, green_target_rect)
-
-    if 1 in targets_active:
-        # show a text for the blue target
-        blue_target_font = targets_font.render(f"RIGHT", True, BLACK)
-        blue_target_rect = blue_target_font.get_rect(center=(400 + target_radius*2.5, target_y))
-        screen.blit(blue_target_font, blue_target_rect)
-
-    if not menu_screen:
-        # Move onsets downward and draw them
-        for onset in onsets:
-            if onset['active']:
-                time_since_onset = current_time - onset['time']
-                onset['y_position'] = onset['start_y'] + beat_speed * time_since_onset
-                pygame.draw.circle(screen, RED, (400 + target_radius*2.5*onset['target_index'], int(onset['y_position'])), 15)
-                
-
-                if onset['y_position'] >= target_y + tolerance:
-                    onset['active'] = False
-                    maxScore += 100
-                    combo_multiplier = 1
-
-        # Check if all onsets are inactive
-        if current_time >= end_trigger_time:
-            menu_screen = True  # Trigger end screen display
         else:
-            # Display score
-            score_text = score_font.render(f"Score: {score}/{maxScore}", True, score_color)
-            screen.blit(score_text, (10, 10))
-            if not menu_screen:
-                pygame.display.flip()
-    else:
-        pygame.display.flip()
-    clock.tick(fps)
-pygame.quit()
+            renderer.clear()
+        profiler.mark("draw")
+
+        # Event handling
+        for event, event_time in timed_input.take():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key in LANE_KEYS and not menu_screen:
+                    # Check if a beat is within the target zone of that lane when the key was pressed
+                    engine.press(LANE_KEYS[event.key], event_time - player_settings["input_offset"])
+                elif ((event.key == pygame.K_c and not start_menu) or (event.key == pygame.K_RETURN and start_menu)) and menu_screen:  # continue game
+                    next_song_color = WHITE
+                    # Reset necessary variables to restart the game, letting go of the last song before the next is loaded
+                    song_wav = None
+                    pygame.mixer.music.unload()
+                    prepared = cycleSong()
+                    if prepared is not None:  # otherwise the menu says why and the song is skipped
+                        end_trigger_time, song_charts, audio_path, song_duration, song_wav = prepared
+                        target0_color = GREEN
+                        target1_color = YELLOW
+                        target2_color = BLUE
+                        beat_speed = max(beat_speed, 10) if 'beat_speed' in locals() else 10  # Ensure valid beat_speed
+                        note_start_y = target_y - (beat_speed * 1.5) + 20  # Start higher above the target
+                        onsets = NoteChart(*song_charts[difficulty], note_start_y)
+                        engine = GameEngine(onsets, tolerance, beat_speed, target_y, -note_radius, max_combo_multiplier)
+                        renderer.set_background(gameplay_background())
+                        play_song(audio_path, song_wav)
+                        audio_clock.start()
+                        current_time = 0
+                        menu_screen = False  # Exit end screen mode
+                        start_menu = False
+                elif event.key == pygame.K_r and menu_screen and not start_menu:  # restart game
+                    next_song_color = WHITE
+                    # Reset necessary variables to restart the game
+                    target0_color = GREEN
+                    target1_color = YELLOW
+                    target2_color = BLUE
+                    beat_speed = max(beat_speed, 10) if 'beat_speed' in locals() else 10  # Ensure valid beat_speed
+                    note_start_y = target_y - (beat_speed * 1.5)  # Start higher above the target
+                    onsets = NoteChart(*song_charts[difficulty], note_start_y)
+                    engine = GameEngine(onsets, tolerance, beat_speed, target_y, -note_radius, max_combo_multiplier)
+                    renderer.set_background(gameplay_background())
+                    play_song(audio_path, song_wav)
+                    audio_clock.start()
+                    current_time = 0
+                    menu_screen = False  # Exit end screen mode
+                elif event.key == pygame.K_UP and menu_screen:
+                    cycle_difficulty(1)
+                elif event.key == pygame.K_DOWN and menu_screen:
+                    cycle_difficulty(-1)
+                elif event.key == pygame.K_k and menu_screen:
+                    offsets = calibration.calibrate(screen, score_font, clock, fps or 60, audio_clock.output_latency, mixer_frequency, mixer_channels)
+                    if offsets is not None:
+                        player_settings["audio_offset"], player_settings["input_offset"] = offsets
+                        audio_clock.audio_offset = player_settings["audio_offset"]
+                        settings.save(player_settings)
+                elif event.key == pygame.K_F3:
+                    show_profiler = not show_profiler
+                elif event.key == pygame.K_F4:
+                    if profiler.trace is None:
+                        print(f"Writing frame trace to {profiler.start_trace(format=player_settings['trace_format'])}")
+                    else:
+                        profiler.stop_trace()
+                elif event.key == pygame.K_LEFT and menu_screen:
+                    songI = (songI - 1) % len(library)
+                    force_next_song = True
+                    next_song_color = YELLOW
+
+                elif event.key == pygame.K_RIGHT and menu_screen:
+                    songI = (songI + 1) % len(library)
+                    force_next_song = True
+                    next_song_color = YELLOW
+                elif event.key == pygame.K_ESCAPE and not menu_screen:
+                    menu_screen = True
+                    pygame.mixer.stop()
+                    pygame.mixer.music.stop()
+                    engine.score = 0
+                    engine.max_score = 0
+        profiler.mark("events")
+
+        # Draw the target zone, during a song it's part of the renderer's background
+        if menu_screen:
+            draw_targets(screen)
+        else:
+            progress_ratio = current_time / (song_duration if song_duration > 0 else 1)
+            progress_width = int((screen.get_width() - 20) * progress_ratio)
+            renderer.fill(GRAY, ((screen.get_width()/2)-progress_width/2, screen.get_height() - 10, progress_width, 10))  # Progress bar at top
+        profiler.mark("draw")
+
+        if not menu_screen:
+            # Long songs are still being analysed, add the notes that arrived since the last frame
+            if song_wav is None:
+                streamed_onsets = prefetcher.take_onsets()
+                if streamed_onsets.size:
+                    onsets.append(*charts.extend_charts(song_charts, streamed_onsets)[difficulty])
+                    engine.judge.rebuild()
+
+            # Simulate up to now in fixed steps (moving notes, missing the ones past the target),
+            # then draw the notes where they are at this exact moment
+            engine.advance_to(current_time)
+            profiler.mark("update")
+            visible = onsets.visible()
+            for lane, y in zip(onsets.lanes[visible], onsets.positions(visible, current_time, beat_speed)):
+                renderer.blit(note_sprite, (400 + target_radius*2.5*lane - note_radius, int(y) - note_radius))
+            profiler.mark("draw")
+
+            if engine.combo_show_time > 0:
+                combo_multiplier_text = text_cache.render(combo_multiplier_font, f"{engine.combo_multiplier}x", LIGHT_GRAY)
+                combo_multiplier_rect = combo_multiplier_text.get_rect(center=(screen.get_width() / 2, 50))
+                renderer.blit(combo_multiplier_text, combo_multiplier_rect)
+
+            # Check if all onsets are inactive
+            if current_time >= end_trigger_time:
+                menu_screen = True  # Trigger end screen display
+            else:
+                # Display score
+                score_text = text_cache.render(score_font, f"Score: {engine.score}/{engine.max_score}", SCORE_FLASH_COLORS.get(engine.score_flash, WHITE))
+                renderer.blit(score_text, (10, 10))
+                if player_settings["show_frame_stats"] and profiler.frame_times:
+                    stats = profiler.stats()
+                    stats_text = text_cache.render(info_font, f"{stats['fps']:.0f} fps  p99 {stats['p99_ms']:.1f} ms", LIGHT_GRAY)
+                    renderer.blit(stats_text, stats_text.get_rect(topright=(screen.get_width() - 10, 10)))
+        profiler.mark("text")
+
+        if show_profiler:
+            for i, line in enumerate(profiler.overlay(info_font, YELLOW)):
+                position = (10, 50 + 15 * i)
+                if menu_screen:
+                    screen.blit(line, position)
+                else:
+                    renderer.blit(line, position)
+            profiler.mark("profiler")
+
+        if menu_screen:
+            pygame.display.flip()
+        else:
+            renderer.present()
+        profiler.mark("present")
+        if first_frame_time is None:
+            first_frame_time = time.perf_counter() - STARTUP_TIME
+            print(f"First frame after {first_frame_time * 1000:.0f} ms")
+
+        # poll input until the frame is due so key presses get accurate timestamps
+        if fps:
+            timed_input.poll_until(frame_start + 1 / fps)
+        clock.tick(fps)
+        profiler.mark("wait")
+    profiler.stop_trace()
+    prefetcher.cancel()
+    library.flush()
+    pygame.quit()
@@ -0,0 +1,75 @@
+"""Note storage for the game loop: parallel arrays plus the window of notes that can be on screen."""
+import numpy as np
+
+# note states
+MISSED = 0  # fell past the target, or not playable any more
+ACTIVE = 1  # still falling, can be hit or missed
+SCORED = 2  # hit by the player
+
+
+class NoteChart:
+    """The notes of one song as parallel arrays sorted by time.
+
+    Only the notes in [head, tail) can be on screen: tail is the first note
+    that hasn't fallen into view yet and head the first one that is still
+    active. Per-frame work only touches that window."""
+
+    def __init__(self, times, lanes, start_y):
+        self.start_y = start_y  # y of a note at its own onset time
+        self.times = np.empty(0)
+        self.lanes = np.empty(0, dtype=np.int8)
+        self.state = np.empty(0, dtype=np.uint8)
+        self.y = np.empty(0)
+        self.head = 0
+        self.tail = 0
+        self.append(times, lanes)
+
+    def __len__(self):
+        return self.times.size
+
+    def append(self, times, lanes):
+        """Add notes, e.g. the streamed part of a long song's chart."""
+        times = np.asarray(times, dtype=np.float64)
+        sorted_on_append = self.times.size == 0 or times.size == 0 or times[0] >= self.times[-1]
+
+        self.times = np.concatenate((self.times, times))
+        self.lanes = np.concatenate((self.lanes, np.asarray(lanes, dtype=np.int8)))
+        self.state = np.concatenate((self.state, np.full(times.size, ACTIVE, dtype=np.uint8)))
+        self.y = np.concatenate((self.y, np.full(times.size, self.start_y)))
+
+        if not sorted_on_append or np.any(np.diff(times) < 0):
+            order = np.argsort(self.times, kind="stable")
+            self.times, self.lanes, self.state, self.y = self.times[order], self.lanes[order], self.state[order], self.y[order]
+            self.head = 0  # re-found on the next update
+
+    def update(self, current_time, beat_speed, top_y, miss_y):
+        """Move the notes in the window and deactivate the ones that fell past miss_y.
+
+        Returns the number of notes missed this call."""
+        # every note falls at the same speed, so earlier notes are always lower and the window is a time range
+        self.tail = int(np.searchsorted(self.times, current_time - (top_y - self.start_y) / beat_speed, side="right"))
+        if self.head >= self.tail:
+            return 0
+
+        window = slice(self.head, self.tail)
+        y = self.y[window]
+        state = self.state[window]
+        y[:] = self.start_y + beat_speed * (current_time - self.times[window])
+        missed = (state == ACTIVE) & (y >= miss_y)
+        state[missed] = MISSED
+
+        # notes in front of the first active one are done with for good
+        active = np.flatnonzero(state == ACTIVE)
+        self.head += int(active[0]) if active.size else self.tail - self.head
+        return int(np.count_nonzero(missed))
+
+    def positions(self, indices, current_time, beat_speed):
+        """y of the given notes at current_time, for drawing between simulation steps."""
+        return self.start_y + beat_speed * (current_time - self.times[indices])
+
+    def visible(self):
+        """Indices of the active notes in the window."""
+        return np.flatnonzero(self.state[self.head:self.tail] == ACTIVE) + self.head
+
+    def score(self, index):
+        self.state[index] = SCORED
@@ -0,0 +1,88 @@
+"""Analyse the whole song library ahead of time so the game never has to wait for a beatmap.
+
+    python preanalyze.py [--songs songs] [--jobs N] [--force]
+
+Beatmaps go to the same on-disk cache the game reads. Every difficulty's
+chart is derived from the same beatmap, so one per song covers them all."""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import analysis
+from library import Library
+
+
+def analyze_file(audio_path, force=False):
+    """Analyse one song into the cache, returns (audio_path, status, seconds, tempo, duration)."""
+    start = time.perf_counter()
+    beatmap = None if force else analysis.cached_beatmap(audio_path)
+    if beatmap is not None:
+        return audio_path, "cached", time.perf_counter() - start, beatmap[1], beatmap[2]
+
+    if analysis.is_long_song(audio_path):
+        for _ in analysis.stream_beatmap(audio_path):  # caches the beatmap once the stream ends
+            pass
+        _, tempo, song_duration = analysis.cached_beatmap(audio_path)
+    else:
+        _, tempo, song_duration = analysis.load_beatmap(audio_path, use_cache=False)
+    return audio_path, "analysed", time.perf_counter() - start, tempo, song_duration
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-analyse every song in the library into the beatmap cache.")
+    parser.add_argument("--songs", default="songs", help="folder with the songs (default: songs)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="worker processes (default: all cores)")
+    parser.add_argument("--force", action="store_true", help="re-analyse songs that are already analysed")
+    args = parser.parse_args(argv)
+
+    library = Library(args.songs)
+    library.refresh(force=True)
+    if not library.songs:
+        print(f"No songs found in {args.songs}")
+        return 1
+    # the index already knows which songs were analysed and haven't changed since, only the rest get
+    # read (hashed for the cache key, and analysed on a miss)
+    song_files = library.songs if args.force else [path for path in library.songs if not library.is_analysed(path)]
+    skipped = len(library.songs) - len(song_files)
+    if skipped:
+        print(f"{skipped} songs unchanged since they were analysed, skipping them")
+
+    print(f"Analysing {len(song_files)} songs with {args.jobs} workers...")
+    timings = []
+    failed = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {pool.submit(analyze_file, audio_path, args.force): audio_path for audio_path in song_files}
+        for done, future in enumerate(as_completed(futures), 1):
+            name = os.path.basename(futures[future])
+            try:
+                audio_path, status, seconds, tempo, song_duration = future.result()
+            except Exception as e:
+                failed.append(name)
+                print(f"[{done}/{len(song_files)}] {name}: failed ({e})")
+                continue
+            library.record_analysis(audio_path, tempo, song_duration)
+            if status == "cached":
+                skipped += 1
+            else:
+                timings.append((seconds, name))
+            print(f"[{done}/{len(song_files)}] {name}: {status} in {seconds:.2f}s")
+    library.flush()
+    elapsed = time.perf_counter() - start
+
+    print()
+    print(f"Done in {elapsed:.1f}s: {len(timings)} analysed, {skipped} already cached, {len(failed)} failed")
+    if timings:
+        total = sum(seconds for seconds, _ in timings)
+        print(f"Analysis time per song: mean {total / len(timings):.2f}s, total {total:.1f}s across workers")
+        print("Slowest songs:")
+        for seconds, name in sorted(timings, reverse=True)[:5]:
+            print(f"  {seconds:7.2f}s  {name}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
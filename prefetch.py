@@ -0,0 +1,218 @@
+"""Decodes and analyses the queued song in a worker process while the menu is showing."""
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import audio
+from charts import empty_onsets
+
+
+def _prepare_job(conn, audio_path, mixer, params):
+    shm = None
+    try:
+        import analysis  # heavy, and only the workers need it
+        if analysis.is_long_song(audio_path):
+            _stream_job(conn, audio_path, params)
+            return
+
+        timings = {}
+        pcm, beatmap = analysis.prepare_song(audio_path, *mixer, *params, timings=timings)
+
+        # the samples are too big to pickle through the pipe, park them in shared memory instead,
+        # already wrapped as the WAV the game plays so it only has to copy them out once
+        wav_size = audio.WAV_HEADER_SIZE + pcm.nbytes
+        shm = shared_memory.SharedMemory(create=True, size=wav_size)
+        audio.write_wav(shm.buf, pcm, mixer[0])
+        del pcm
+        conn.send(("ok", (beatmap, shm.name, wav_size, timings)))
+
+        # windows frees the block with its last handle, so hold ours until the game has copied it
+        conn.recv()
+    except EOFError:
+        pass
+    except Exception as e:
+        conn.send(("error", repr(e)))
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+        conn.close()
+
+
+def _stream_job(conn, audio_path, params):
+    import analysis
+    # long songs play straight from disk, only the chart comes back, piece by piece
+    beatmap = analysis.cached_beatmap(audio_path, *params)
+    if beatmap is not None:
+        conn.send(("ok", (beatmap, None, None, {})))
+        return
+    for message in analysis.stream_beatmap(audio_path, *params):
+        conn = _send(conn, message)
+    _send(conn, ("end", None))
+
+
+def _send(conn, message):
+    """Send unless the game stopped listening, returns the connection or None once it's gone.
+
+    A detached stream (see Prefetcher.cancel) keeps analysing without anyone
+    listening, so its beatmap still ends up in the cache."""
+    if conn is None:
+        return None
+    try:
+        conn.send(message)
+    except OSError:
+        return None
+    return conn
+
+
+class Prefetcher:
+    """Prepares one song at a time, a request for another song cancels the running job.
+
+    Songs long enough to stream (analysis.is_long_song) are analysed in
+    bounded memory in the worker, whichever way they were requested.
+
+    take() returns (song_wav, (onsets, tempo, song_duration)), song_wav
+    being the decoded song as WAV bytes. Until then a finished song stays in
+    the worker's shared memory and result only holds its beatmap. Long songs come back with song_wav
+    None, to be played from disk, and only the head of their chart; the rest
+    arrives through take_onsets() while the song plays."""
+
+    def __init__(self, mixer_frequency, mixer_channels):
+        self.mixer = (mixer_frequency, mixer_channels)
+        self.job = None  # (audio_path, params) of the running or finished job
+        self.result = None
+        self.timings = {}  # seconds per analysis stage of the finished job, from analysis.prepare_song
+        self.error = None  # why the current job failed, if it did
+        self.streaming = False  # more onsets of a long song are still on the way
+        self._streamed = []  # onset chunks of a long song, in arrival order
+        self._handed_out = 0  # chunks already given to the game
+        self._process = None
+        self._conn = None
+        self._wav = None  # (shared memory name, size) of a finished song's WAV, copied out by take()
+        self._detached = []  # stream workers left to finish caching their beatmap
+
+    def request(self, audio_path, delta=0.22, pre_max=10.5, post_max=10.5, auto:bool = True):
+        """Start preparing audio_path in the background, unless it already is."""
+        job = (audio_path, (delta, pre_max, post_max, auto))
+        if job == self.job:
+            return
+        self.cancel()
+
+        parent_conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_prepare_job, args=(child_conn, audio_path, self.mixer, job[1]), daemon=True)
+        self._process.start()
+        child_conn.close()  # closing our copy of the worker's end lets recv() notice a dead worker
+        self._conn = parent_conn
+        self.job = job
+
+    def cancel(self):
+        """Drop the current job, killing the worker if it is still running.
+
+        A long song whose chart is still streaming is left to finish instead:
+        killing it would throw away the analysis before it reaches the cache."""
+        if self._wav is not None:
+            self._release_wav(copy=False)
+        if self._process is not None and self._process.is_alive():
+            if self.streaming:
+                self._detached.append(self._process)
+                self._process = None
+            else:
+                self._process.terminate()
+        self._detached = [process for process in self._detached if process.is_alive()]
+        self._cleanup()
+        self.job = None
+        self.result = None
+        self.timings = {}
+        self.error = None
+        self.streaming = False
+        self._streamed = []
+        self._handed_out = 0
+
+    def poll(self):
+        """Collect a finished result without blocking, returns True once the current job is done."""
+        while self._conn is not None and self._conn.poll():
+            self._receive()
+        return self.result is not None
+
+    def take(self, audio_path, delta=0.22, pre_max=10.5, post_max=10.5, auto:bool = True):
+        """Return the result for audio_path, waiting for the worker if it's still running.
+
+        Returns None when no job for that song exists or the worker failed.
+        The result is handed over, not kept: the song is the biggest thing
+        the game holds and it shouldn't be held twice. That's also why the
+        decoded song is only copied out of shared memory here, let go of the
+        last one before calling this."""
+        if self.job != (audio_path, (delta, pre_max, post_max, auto)):
+            return None
+        while self._conn is not None and self.result is None:
+            self._receive()
+        self.poll()
+        result, self.result = self.result, None
+        if result is not None and self._wav is not None:
+            result = (self._release_wav(copy=True), result[1])
+        if result is not None and self._streamed:
+            song_wav, (_, tempo, song_duration) = result
+            self._handed_out = len(self._streamed)
+            return song_wav, (np.concatenate(self._streamed), tempo, song_duration)
+        return result
+
+    def take_onsets(self):
+        """Return the streamed onsets that arrived after the last take()/take_onsets()."""
+        self.poll()
+        new_chunks = self._streamed[self._handed_out:]
+        self._handed_out = len(self._streamed)
+        return np.concatenate(new_chunks) if new_chunks else empty_onsets()
+
+    def _receive(self):
+        try:
+            status, payload = self._conn.recv()
+        except EOFError:  # worker died without answering
+            status, payload = "error", "worker exited"
+        if status == "ok":
+            beatmap, shm_name, wav_size, self.timings = payload
+            self.result = (None, beatmap)
+            if shm_name is not None:
+                # the song waits in the worker's shared memory until take(), the game may still hold
+                # the last one for a restart and two decoded songs shouldn't be resident at once
+                self._wav = (shm_name, wav_size)
+                return
+        elif status == "onsets":
+            self._streamed.append(payload)
+            return
+        elif status == "head":
+            tempo, song_duration = payload
+            self.result = (None, (empty_onsets(), tempo, song_duration))
+            self.streaming = True
+            return
+        elif status == "end":
+            self.streaming = False
+        else:
+            print(f"Background analysis of {self.job[0]} failed: {payload}")
+            self.error = payload
+            self.streaming = False
+        self._cleanup()
+
+    def _release_wav(self, copy):
+        """Let the worker free the finished song's shared memory, returns the WAV bytes if copy."""
+        shm_name, wav_size = self._wav
+        self._wav = None
+        song_wav = None
+        if copy:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            try:
+                song_wav = bytes(shm.buf[:wav_size])  # the block can be larger than asked for
+            finally:
+                shm.close()
+        try:
+            self._conn.send("done")  # the worker unlinks the block once it hears back
+        except OSError:
+            pass
+        self._cleanup()
+        return song_wav
+
+    def _cleanup(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._process is not None:
+            self._process.join()
+            self._process = None
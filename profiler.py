@@ -0,0 +1,152 @@
+"""Frame profiler: where the time of each frame went, as an overlay and as a trace file.
+
+The game loop calls begin_frame() at the top of every frame and mark(phase)
+after each part of it; the time since the previous mark is charged to that
+phase. The whole frame times are FramePacer's, so stats() gives the fps
+readout and phase_stats() the overlay from the same frames. Analysis stages are timed with stage() into a plain dict and added to
+the trace with record_analysis()."""
+import csv
+import json
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from frame_pacing import FramePacer, percentile
+
+TRACE_DIR = "traces"
+OVERLAY_REFRESH = 0.25  # seconds between overlay redraws, the numbers are unreadable at full frame rate
+
+
+@contextmanager
+def stage(timings, name):
+    """Add the time spent in the with-block to timings[name] (seconds), does nothing when timings is None."""
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+class FrameProfiler(FramePacer):
+    """Rolling per-phase frame timings over the last `window` frames, plus an optional trace file."""
+
+    def __init__(self, window=240):
+        super().__init__(window)
+        self.window = window
+        self.phases = {}  # phase -> deque of seconds, in the order the phases were first seen
+        self.frame = 0
+        self.trace = None
+        self._last_mark = None
+        self._current = {}
+        self._overlay = []
+        self._overlay_time = 0.0
+
+    def begin_frame(self):
+        """Close the previous frame and start timing a new one."""
+        total = self.tick()
+        if total is not None:
+            for phase, samples in self.phases.items():
+                samples.append(self._current.get(phase, 0.0))
+            if self.trace is not None:
+                self.trace.write_frame(self.frame, self._current, total)
+            self.frame += 1
+        self._last_mark = self._last
+        self._current = {}
+
+    def mark(self, phase):
+        """Charge the time since the last mark (or the frame start) to phase."""
+        if self._last_mark is None:
+            return
+        now = time.perf_counter()
+        self._current[phase] = self._current.get(phase, 0.0) + now - self._last_mark
+        self._last_mark = now
+        if phase not in self.phases:
+            # pad with zeros so every phase lines up with the frame totals
+            self.phases[phase] = deque([0.0] * len(self.frame_times), maxlen=self.window)
+
+    def phase_stats(self):
+        """{"frame" or phase: (p50, p95, p99)} in milliseconds over the window, empty before the first frame."""
+        result = {}
+        for name, samples in (("frame", self.frame_times), *self.phases.items()):
+            if samples:
+                ordered = sorted(samples)
+                result[name] = tuple(percentile(ordered, fraction) * 1000 for fraction in (0.5, 0.95, 0.99))
+        return result
+
+    def overlay(self, font, color):
+        """The overlay text lines as surfaces, re-rendered at most every OVERLAY_REFRESH seconds."""
+        now = time.perf_counter()
+        if now - self._overlay_time >= OVERLAY_REFRESH:
+            lines = ["ms            p50    p95    p99"]
+            for name, (p50, p95, p99) in self.phase_stats().items():
+                lines.append(f"{name:<12}{p50:7.2f}{p95:7.2f}{p99:7.2f}")
+            if self.trace is not None:
+                lines.append(f"tracing to {self.trace.path}")
+            self._overlay = [font.render(line, True, color) for line in lines]
+            self._overlay_time = now
+        return self._overlay
+
+    def start_trace(self, path=None, format="csv"):
+        """Start writing every frame to a trace file, by default a new one in TRACE_DIR."""
+        self.stop_trace()
+        if path is None:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            path = os.path.join(TRACE_DIR, time.strftime(f"trace-%Y%m%d-%H%M%S.{format}"))
+        self.trace = TraceWriter(path)
+        return path
+
+    def stop_trace(self):
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+    def record_analysis(self, audio_path, timings):
+        """Add the analysis stage timings of a song to the trace, if one is being written."""
+        if self.trace is not None and timings:
+            self.trace.write_analysis(audio_path, timings)
+
+
+class TraceWriter:
+    """One row per frame phase or analysis stage: kind, label, stage, ms.
+
+    kind is "frame" (label is the frame number, stage a phase or "total") or
+    "analysis" (label is the song). A .json path gets the same rows as a list
+    of objects, written on close()."""
+
+    COLUMNS = ("kind", "label", "stage", "ms")
+
+    def __init__(self, path):
+        self.path = path
+        self.json = path.lower().endswith(".json")
+        self._rows = []
+        self._file = None
+        if not self.json:
+            self._file = open(path, "w", newline="")
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(self.COLUMNS)
+
+    def write_frame(self, frame, phases, total):
+        for phase, seconds in phases.items():
+            self._write("frame", frame, phase, seconds)
+        self._write("frame", frame, "total", total)
+
+    def write_analysis(self, audio_path, timings):
+        for name, seconds in timings.items():
+            self._write("analysis", audio_path, name, seconds)
+
+    def _write(self, kind, label, name, seconds):
+        row = (kind, label, name, round(seconds * 1000, 3))
+        if self.json:
+            self._rows.append(dict(zip(self.COLUMNS, row)))
+        else:
+            self._csv.writerow(row)
+
+    def close(self):
+        if self.json:
+            with open(self.path, "w") as f:
+                json.dump(self._rows, f)
+        else:
+            self._file.close()
@@ -0,0 +1,61 @@
+"""Gameplay drawing: pre-rendered sprites and dirty-rectangle display updates."""
+import pygame
+
+
+def circle_sprite(color, radius):
+    """A per-pixel-alpha surface holding a filled circle, blitting it is cheaper than drawing the circle."""
+    sprite = pygame.Surface((radius * 2, radius * 2), pygame.SRCALPHA)
+    pygame.draw.circle(sprite, color, (radius, radius), radius)
+    return sprite.convert_alpha()
+
+
+class Renderer:
+    """Draws a frame over a static background and only sends the areas that changed to the display.
+
+    Every blit/fill made through the renderer is remembered; the next frame
+    restores the background under those rectangles instead of clearing the
+    whole screen, and present() updates only the old and new rectangles.
+    With dirty=False it clears and flips the whole screen every frame."""
+
+    def __init__(self, screen, dirty=True):
+        self.screen = screen
+        self.dirty = dirty
+        self.background = pygame.Surface(screen.get_size()).convert()
+        self._previous = []  # rectangles drawn last frame
+        self._current = []
+        self._full = True  # next frame has to redraw and flip everything
+
+    def set_background(self, background):
+        self.background = background
+        self.invalidate()
+
+    def invalidate(self):
+        """Redraw the whole screen on the next frame, e.g. after something drew outside the renderer."""
+        self._full = True
+
+    def clear(self):
+        """Restore the background where the last frame drew."""
+        if self._full or not self.dirty:
+            self.screen.blit(self.background, (0, 0))
+        else:
+            for rect in self._previous:
+                self.screen.blit(self.background, rect, rect)
+
+    def blit(self, surface, dest):
+        rect = self.screen.blit(surface, dest)
+        self._current.append(rect)
+        return rect
+
+    def fill(self, color, rect):
+        rect = self.screen.fill(color, rect)
+        self._current.append(rect)
+        return rect
+
+    def present(self):
+        if self._full or not self.dirty:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self._previous + self._current)
+        self._previous = self._current
+        self._current = []
+        self._full = False
@@ -0,0 +1,34 @@
+"""Player settings, kept in settings.json next to the game."""
+import json
+import os
+
+SETTINGS_PATH = "settings.json"
+
+DEFAULTS = {
+    "mixer_buffer": 512,  # samples per mixer buffer, smaller means less audio latency but more risk of crackling
+    "audio_offset": 0.0,  # seconds the audio is heard later than the mixer clock says, from calibration
+    "input_offset": 0.0,  # seconds key presses arrive later than the player meant them, from calibration
+    "frame_rate": 60,  # frame cap, 0 draws as fast as possible
+    "vsync": False,  # wait for the display's refresh instead of (or on top of) the frame cap
+    "show_frame_stats": False,  # frame pacing readout in the corner during songs
+    "show_profiler": False,  # per-phase frame timing overlay at startup, F3 toggles it
+    "trace_format": "csv",  # "csv" or "json", for the frame traces F4 writes to traces/
+}
+
+
+def load(path=SETTINGS_PATH):
+    settings = dict(DEFAULTS)
+    try:
+        with open(path) as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        return settings
+    settings.update({key: value for key, value in stored.items() if key in DEFAULTS})
+    return settings
+
+
+def save(settings, path=SETTINGS_PATH):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(settings, f, indent=4)
+    os.replace(tmp_path, path)
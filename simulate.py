@@ -0,0 +1,102 @@
+"""Play a chart without a window or audio, as fast as the rules can run.
+
+simulate() takes a chart and a stream of key presses and returns the score
+and every note's judgment; song time only advances to each press and then to
+the end, so a song takes milliseconds. Meant for checking charts across the
+whole library and trying scoring changes without pygame.
+
+    python simulate.py [--songs songs] [--difficulty hard] [--jitter 0.03]
+
+plays every analysed song of the library with generated presses and prints
+what each one scored."""
+import numpy as np
+from charts import build_charts
+from engine import GameEngine, DIFFICULTY_SETTINGS
+from notes import NoteChart
+
+# the game's layout, see main.py
+TARGET_Y = 550
+NOTE_RADIUS = 15
+LEAD_IN = 1.5  # seconds notes take from where they start to the target
+
+
+def make_engine(times, lanes, difficulty):
+    """A GameEngine on a fresh chart, laid out like a song in the game."""
+    settings = DIFFICULTY_SETTINGS[difficulty]
+    chart = NoteChart(times, lanes, TARGET_Y - settings["beat_speed"] * LEAD_IN)
+    return GameEngine(chart, settings["tolerance"], settings["beat_speed"], TARGET_Y, -NOTE_RADIUS, settings["max_combo"])
+
+
+def simulate(times, lanes, presses, difficulty="normal", end_time=None):
+    """Play a chart with the given presses, returns a dict with the score, max_score, counts, grades and errors.
+
+    presses is an iterable of (press_time, lane) in song time, the same
+    clock the notes' onset times are on. end_time defaults to when the last
+    note can no longer be hit."""
+    engine = make_engine(times, lanes, difficulty)
+    for press_time, lane in sorted(presses, key=lambda press: press[0]):
+        engine.press(int(lane), float(press_time))
+    if end_time is None:
+        last_note = engine.chart.times[-1] if len(engine.chart) else 0.0
+        end_time = last_note + (engine.miss_y - engine.chart.start_y) / engine.beat_speed + engine.step_length
+    engine.advance_to(end_time)
+
+    grades, errors = engine.judgments()
+    return {
+        "score": engine.score,
+        "max_score": engine.max_score,
+        "counts": dict(engine.judge.counts),
+        "grades": grades,
+        "errors": errors,
+    }
+
+
+def generated_presses(times, lanes, difficulty, jitter=0.0, seed=0):
+    """One press per note at the moment it reaches the target, off by normally distributed jitter seconds."""
+    engine = make_engine([], [], difficulty)
+    rng = np.random.default_rng(seed)
+    press_times = np.asarray(times) + engine.judge.hit_offset
+    if jitter:
+        press_times = press_times + rng.normal(0.0, jitter, press_times.size)
+    return list(zip(press_times, lanes))
+
+
+def main(argv=None):
+    import argparse
+    import time
+    import analysis
+    from library import Library
+
+    parser = argparse.ArgumentParser(description="Play every analysed song of the library headless with generated presses.")
+    parser.add_argument("--songs", default="songs", help="folder with the songs (default: songs)")
+    parser.add_argument("--difficulty", nargs="+", default=list(DIFFICULTY_SETTINGS), choices=list(DIFFICULTY_SETTINGS))
+    parser.add_argument("--jitter", type=float, default=0.0, help="timing error of the presses in seconds (standard deviation)")
+    args = parser.parse_args(argv)
+
+    library = Library(args.songs)
+    library.refresh(force=True)
+    song_seconds = 0.0
+    elapsed = 0.0
+    for audio_path in library.songs:
+        beatmap = analysis.cached_beatmap(audio_path)
+        if beatmap is None:
+            print(f"{audio_path}: not analysed, run preanalyze.py first")
+            continue
+        onsets, _, song_duration = beatmap
+        for difficulty, (times, lanes) in build_charts(onsets).items():
+            if difficulty not in args.difficulty:
+                continue
+            presses = generated_presses(times, lanes, difficulty, args.jitter)
+            start = time.perf_counter()
+            result = simulate(times, lanes, presses, difficulty)
+            elapsed += time.perf_counter() - start
+            song_seconds += song_duration
+            percentage = 100 * result["score"] / result["max_score"] if result["max_score"] > 0 else 0
+            counts = "  ".join(f"{grade}: {count}" for grade, count in result["counts"].items())
+            print(f"{audio_path} [{difficulty}] {len(times)} notes, score {result['score']}/{result['max_score']} ({percentage:.0f}%)  {counts}")
+    if song_seconds:
+        print(f"Simulated {song_seconds / 60:.1f} minutes of songs in {elapsed:.2f}s ({song_seconds / max(elapsed, 1e-9):.0f}x realtime)")
+
+
+if __name__ == "__main__":
+    main()
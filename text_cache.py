@@ -0,0 +1,23 @@
+"""Cache of rendered text surfaces, most HUD and menu text is the same from one frame to the next."""
+from collections import OrderedDict
+
+
+class TextCache:
+    """Font.render() results keyed on (font, text, color, antialias), least recently used dropped first."""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._surfaces = OrderedDict()
+
+    def render(self, font, text, color, antialias=True):
+        key = (font, text, color, antialias)
+        surface = self._surfaces.get(key)
+        if surface is not None:
+            self._surfaces.move_to_end(key)
+            return surface
+
+        surface = font.render(text, antialias, color)
+        self._surfaces[key] = surface
+        if len(self._surfaces) > self.max_entries:
+            self._surfaces.popitem(last=False)
+        return surface
@@ -0,0 +1,43 @@
+"""Input with timestamps: events are stamped on the song clock when they are polled, not when a frame gets to them."""
+import time
+import pygame
+
+# how often input is polled while waiting for the next frame, 0 polls only once per frame
+INPUT_POLL_HZ = 1000
+
+
+class TimedInput:
+    """Queue of (event, song time) pairs.
+
+    Between frames poll_until() keeps draining pygame's event queue at
+    poll_hz, so a key press is stamped within about a millisecond of
+    arriving instead of up to a whole frame later."""
+
+    def __init__(self, song_clock, poll_hz=INPUT_POLL_HZ):
+        self.song_clock = song_clock  # callable returning the current song time in seconds
+        self.poll_interval = 1.0 / poll_hz if poll_hz else None
+        self.events = []
+
+    def pump(self):
+        """Move everything in pygame's queue into ours, stamped with the current song time."""
+        events = pygame.event.get()
+        if events:
+            now = self.song_clock()
+            self.events.extend((event, now) for event in events)
+
+    def take(self):
+        """Return and clear the stamped events collected so far."""
+        self.pump()
+        events, self.events = self.events, []
+        return events
+
+    def poll_until(self, deadline):
+        """Keep polling input until time.perf_counter() reaches deadline."""
+        if self.poll_interval is None:
+            return
+        while True:
+            self.pump()
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return
+            time.sleep(min(self.poll_interval, remaining))
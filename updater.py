@@ -0,0 +1,171 @@
+"""Update check and download of the latest GitHub release, off the main thread so the game never waits on the network.
+
+The release API URL can be pointed somewhere else with BEAT_DOWN_UPDATE_API,
+e.g. a local server standing in for GitHub:
+
+    python updater.py --api http://127.0.0.1:8000/latest.json [--download]"""
+import hashlib
+import os
+import threading
+
+# Define current release version
+release_version = "v1.1.0"
+
+# GitHub repository details
+GITHUB_REPO = "jacs121/beat-down"
+LATEST_RELEASE_API = os.environ.get("BEAT_DOWN_UPDATE_API", f"https://api.github.com/repos/{GITHUB_REPO}/releases/latest")
+UPDATE_CHECK_TIMEOUT = 5  # seconds
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+DOWNLOAD_TIMEOUT = 30  # seconds without data before a download gives up, it resumes on the next try
+
+
+def check_for_update(api_url=LATEST_RELEASE_API, current_version=release_version, timeout=UPDATE_CHECK_TIMEOUT):
+    """Return (latest_version, download_url, size, sha256) when a different release is out, None when up to date.
+
+    size and sha256 are what the release publishes for the asset, None when it doesn't.
+    Network and API errors are raised."""
+    import requests  # only needed here, and off the main thread
+
+    response = requests.get(api_url, timeout=timeout)
+    response.raise_for_status()
+    latest_release = response.json()
+
+    latest_version = latest_release["tag_name"]
+    asset = latest_release["assets"][0]
+    if latest_version == current_version:
+        return None
+    digest = asset.get("digest") or ""  # "sha256:<hex>" on releases that have one
+    sha256 = digest.split(":", 1)[1] if digest.startswith("sha256:") else None
+    return latest_version, asset["browser_download_url"], asset.get("size"), sha256
+
+
+def check_in_background(on_update, api_url=LATEST_RELEASE_API):
+    """Run check_for_update on a daemon thread, calling on_update(*update) from it if there's one."""
+    def run():
+        try:
+            update = check_for_update(api_url)
+        except Exception as e:
+            print(f"Failed to check for updates: {e}")
+            return
+        if update is not None:
+            on_update(*update)
+
+    thread = threading.Thread(target=run, name="update-check", daemon=True)
+    thread.start()
+    return thread
+
+
+def update_path(latest_version):
+    return os.path.join(os.getcwd(), f"beat down - {latest_version}.exe")  # Save as "beat down - {version}.exe"
+
+
+class UpdateDownload:
+    """Downloads a release to path on a daemon thread.
+
+    Data goes to path + ".part" first. A .part left over by an earlier try is
+    continued with an HTTP Range request instead of starting over. The
+    finished file is checked against the published size and sha256, then
+    renamed over path in one step. Poll progress(), done and error from the
+    game loop."""
+
+    def __init__(self, url, path, size=None, sha256=None):
+        self.url = url
+        self.path = path
+        self.part_path = path + ".part"
+        self.size = size
+        self.sha256 = sha256
+        self.downloaded = 0
+        self.done = False  # finished, successfully or not
+        self.error = None  # why it failed, None while running or after success
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="update-download", daemon=True)
+        self._thread.start()
+        return self
+
+    def progress(self):
+        """Fraction downloaded, None when the size isn't known."""
+        if not self.size:
+            return None
+        return min(self.downloaded / self.size, 1.0)
+
+    def _run(self):
+        try:
+            self._download()
+            self._verify()
+            os.replace(self.part_path, self.path)  # the real file name only ever holds a complete, verified download
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.done = True
+
+    def _download(self):
+        import requests
+
+        digest = hashlib.sha256()
+        offset = os.path.getsize(self.part_path) if os.path.exists(self.part_path) else 0
+        if self.size is not None and offset > self.size:
+            offset = 0  # not a part of this release
+        if offset:
+            # the hash has to cover the part we already have
+            with open(self.part_path, "rb") as f:
+                for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            if offset == self.size:
+                self.downloaded = offset
+                self._digest = digest
+                return
+
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        with requests.get(self.url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            if offset and response.status_code == 416:
+                # nothing past what we have: the .part is already complete, the release just didn't say its size
+                total = response.headers.get("Content-Range", "").rpartition("/")[2]
+                if total.isdigit() and int(total) != offset:
+                    os.remove(self.part_path)  # not a part of this file after all, start over on the next try
+                    raise IOError(f"partial download is {offset} bytes but the file is {total}, it will restart on the next try")
+                self.downloaded = offset
+                self._digest = digest
+                return
+            response.raise_for_status()
+            if offset and response.status_code != 206:  # server ignored the range, start over
+                offset = 0
+                digest = hashlib.sha256()
+            if self.size is None and "Content-Length" in response.headers:
+                self.size = offset + int(response.headers["Content-Length"])
+            self.downloaded = offset
+            with open(self.part_path, "ab" if offset else "wb") as f:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    self.downloaded += len(chunk)
+        self._digest = digest
+
+    def _verify(self):
+        if self.size is not None and self.downloaded != self.size:
+            raise IOError(f"download is {self.downloaded} bytes, expected {self.size}, it will resume on the next try")
+        if self.sha256 is not None and self._digest.hexdigest() != self.sha256.lower():
+            os.remove(self.part_path)  # resuming a corrupt file can't fix it
+            raise IOError("downloaded file doesn't match the release's sha256")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the game's update check once and print the result.")
+    parser.add_argument("--api", default=LATEST_RELEASE_API, help="release API URL to ask")
+    parser.add_argument("--version", default=release_version, help="version to compare against")
+    parser.add_argument("--download", action="store_true", help="also download the update into the current folder")
+    args = parser.parse_args()
+    update = check_for_update(args.api, args.version)
+    print("up to date" if update is None else f"update available: {update[0]} at {update[1]}")
+
+    if update is not None and args.download:
+        import time
+        latest_version, url, size, sha256 = update
+        download = UpdateDownload(url, update_path(latest_version), size, sha256).start()
+        while not download.done:
+            time.sleep(0.5)
+            print(f"{download.downloaded} / {download.size or '?'} bytes")
+        print(f"failed: {download.error}" if download.error else f"saved to {download.path}")